@@ -0,0 +1,251 @@
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Alphabet of Firebase push ids, in ASCII order so ids sort by creation time
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+# Firebase ordering of value types: null, false, true, numbers, strings, objects
+RANK_NULL, RANK_FALSE, RANK_TRUE, RANK_NUMBER, RANK_STRING, RANK_OBJECT = range(6)
+
+
+def split_path(path: str) -> List[str]:
+    return [key for key in str(path or '').strip('/').split('/') if key]
+
+
+def clone(value: Any) -> Any:
+    """Copy of a JSON-like value, so callers can't mutate the stored one"""
+    if isinstance(value, dict):
+        return {key: clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [clone(item) for item in value]
+    return value
+
+
+def as_dict(value: Any) -> Dict:
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, list):
+        # Firebase returns integer-keyed children as arrays
+        return {str(i): item for i, item in enumerate(value) if item is not None}
+    return {}
+
+
+def get_value(root: Any, keys: List[str]) -> Any:
+    node = root
+    for key in keys:
+        node = as_dict(node).get(key)
+        if node is None:
+            return None
+    return node
+
+
+def put_value(root: Any, keys: List[str], value: Any) -> Any:
+    """Set (or with None, delete) the value at keys below root and return the new root
+
+    Like Firebase, nodes left without children are removed. A dict root is
+    changed in place.
+    """
+    if not keys:
+        return value
+    root = as_dict(root)
+    parents = []
+    node = root
+    for key in keys[:-1]:
+        child = node.get(key)
+        if not isinstance(child, dict):
+            child = as_dict(child)
+            node[key] = child
+        parents.append((node, key))
+        node = child
+
+    if value is None:
+        node.pop(keys[-1], None)
+        for parent, key in reversed(parents):
+            if parent[key]:
+                break
+            del parent[key]
+    else:
+        node[keys[-1]] = value
+    return root or None
+
+
+def increment(delta) -> Dict:
+    """Server value adding delta to the stored number (0 if missing), applied atomically by Firebase"""
+    return {'.sv': {'increment': delta}}
+
+
+def is_server_value(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and '.sv' in value
+
+
+def has_server_values(value: Any) -> bool:
+    if is_server_value(value):
+        return True
+    return isinstance(value, dict) and any(has_server_values(item) for item in value.values())
+
+
+def resolve_server_values(value: Any, current: Any) -> Any:
+    """value with server values replaced by what Firebase would store over current
+
+    Used by backends that don't run on the Firebase server.
+    """
+    if is_server_value(value):
+        server_value = value['.sv']
+        if isinstance(server_value, dict) and 'increment' in server_value:
+            base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+            return base + server_value['increment']
+        if server_value == 'timestamp':
+            return int(time.time() * 1000)
+        raise ValueError(f'Unsupported server value: {server_value!r}')
+    if isinstance(value, dict):
+        current = as_dict(current)
+        return {key: resolve_server_values(item, current.get(key)) for key, item in value.items()}
+    return value
+
+
+def sort_key(value: Any) -> Tuple[int, float, str]:
+    """(rank, number, text) placing a value in Firebase's ordering"""
+    if value is None:
+        return (RANK_NULL, 0.0, '')
+    if value is False:
+        return (RANK_FALSE, 0.0, '')
+    if value is True:
+        return (RANK_TRUE, 0.0, '')
+    if isinstance(value, (int, float)):
+        return (RANK_NUMBER, float(value), '')
+    if isinstance(value, str):
+        return (RANK_STRING, 0.0, value)
+    return (RANK_OBJECT, 0.0, '')
+
+
+def key_order(key: str) -> Tuple[int, int, str]:
+    """Firebase key ordering: 32-bit integer keys numerically first, then strings"""
+    key = str(key)
+    if key.lstrip('-').isdigit() and key == str(int(key)) and -2 ** 31 <= int(key) < 2 ** 31:
+        return (0, int(key), '')
+    return (1, 0, key)
+
+
+class PushIdGenerator:
+    """Firebase-style push ids: 8 characters of millisecond timestamp and 12 random ones
+
+    Ids made in the same millisecond increment the random part, so ids from
+    one process always sort in creation order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_random = [0] * 12
+
+    def generate(self) -> str:
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now == self._last_ms:
+                for i in range(11, -1, -1):
+                    if self._last_random[i] < 63:
+                        self._last_random[i] += 1
+                        break
+                    self._last_random[i] = 0
+            else:
+                self._last_ms = now
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            stamp = []
+            for _ in range(8):
+                stamp.append(PUSH_CHARS[now % 64])
+                now //= 64
+            return ''.join(reversed(stamp)) + ''.join(PUSH_CHARS[i] for i in self._last_random)
+
+
+generate_push_id = PushIdGenerator().generate
+
+
+class Query:
+    """Ordered query on a reference, like firebase_admin.db.Query
+
+    Created by a backend reference's order_by_child/order_by_key/order_by_value;
+    get() hands it back to the reference's _run_query. Filters return the
+    query itself so calls chain.
+    """
+
+    def __init__(self, ref, order_by: str, child_path: Optional[str] = None):
+        if order_by == 'child':
+            if not child_path or str(child_path).startswith(('$', '.')):
+                raise ValueError(f'Invalid child path: {child_path!r}')
+        self._ref = ref
+        self.order_by = order_by
+        self.child_keys = split_path(child_path) if order_by == 'child' else []
+        self.start = None
+        self.end = None
+        self.limit_first = None
+        self.limit_last = None
+
+    def start_at(self, start) -> 'Query':
+        if start is None:
+            raise ValueError('Start value must not be None')
+        self.start = start
+        return self
+
+    def end_at(self, end) -> 'Query':
+        if end is None:
+            raise ValueError('End value must not be None')
+        self.end = end
+        return self
+
+    def equal_to(self, value) -> 'Query':
+        if value is None:
+            raise ValueError('Equal to value must not be None')
+        self.start = self.end = value
+        return self
+
+    def limit_to_first(self, limit: int) -> 'Query':
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError('Limit must be a non-negative integer')
+        if self.limit_last is not None:
+            raise ValueError('Cannot set both first and last limits')
+        self.limit_first = limit
+        return self
+
+    def limit_to_last(self, limit: int) -> 'Query':
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError('Limit must be a non-negative integer')
+        if self.limit_first is not None:
+            raise ValueError('Cannot set both first and last limits')
+        self.limit_last = limit
+        return self
+
+    def get(self) -> Dict:
+        return self._ref._run_query(self)
+
+    def position(self, key: str, value: Any) -> Tuple:
+        """Sort position of a child: its ordered value, then its key"""
+        if self.order_by == 'key':
+            return (key_order(key),)
+        if self.order_by == 'child':
+            for child_key in self.child_keys:
+                value = as_dict(value).get(child_key)
+        return (sort_key(value), key_order(key))
+
+    def bound(self, value: Any) -> Tuple:
+        """Position prefix a start/end value is compared with"""
+        if self.order_by == 'key':
+            return (key_order(value),)
+        return (sort_key(value),)
+
+    def evaluate(self, value: Any) -> Dict:
+        """Run the query over the children of value held in memory"""
+        ordered = sorted(((self.position(key, item), key, item) for key, item in as_dict(value).items()),
+                         key=lambda entry: entry[0])
+        if self.start is not None:
+            start = self.bound(self.start)
+            ordered = [entry for entry in ordered if entry[0][:len(start)] >= start]
+        if self.end is not None:
+            end = self.bound(self.end)
+            ordered = [entry for entry in ordered if entry[0][:len(end)] <= end]
+        if self.limit_first is not None:
+            ordered = ordered[:self.limit_first]
+        if self.limit_last is not None:
+            ordered = ordered[max(0, len(ordered) - self.limit_last):]
+        return {key: clone(item) for _, key, item in ordered}
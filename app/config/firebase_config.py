@@ -2,6 +2,13 @@ import firebase_admin
 from firebase_admin import credentials, db
 import os
 import json
+import copy
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from app.config.db_tree import Query, generate_push_id, get_value, put_value, resolve_server_values, split_path
+from app.config.replica import ReplicatedRef, live_replica, replica_enabled
+from app.config.sqlite_database import SQLITE_DATABASE_PATH, SQLiteDatabase
 
 def initialize_firebase():
     """Initialize Firebase Admin SDK with service account key"""
@@ -35,8 +42,12 @@ def initialize_firebase():
                 
                 database_url = database_urls[0]  # Default to Asia Southeast
                 firebase_admin.initialize_app(cred, {
-                    'databaseURL': database_url
+                    'databaseURL': database_url,
+                    # Without a timeout a stalled connection holds a worker thread indefinitely
+                    'httpTimeout': float(os.getenv('FIREBASE_HTTP_TIMEOUT', '10'))
                 })
+                # Anything resolved before initialization was the mock
+                database.reset()
                 
                 print("✅ Firebase connected successfully to real database!")
                 return True
@@ -51,6 +62,61 @@ def initialize_firebase():
         print("⚠️  Falling back to mock database")
         return False
 
+# Serializes MockDatabaseRef.transaction and server-value updates across request threads
+_mock_transaction_lock = threading.RLock()
+
+# Registrations created by MockDatabaseRef.listen
+_mock_listeners = []
+_mock_listeners_lock = threading.Lock()
+
+class MockEvent:
+    """Stand-in for firebase_admin.db.Event"""
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+class MockListenerRegistration:
+    """Stand-in for firebase_admin.db.ListenerRegistration
+    
+    Receives put/patch events for writes made through the mock and, like the
+    real stream, a keep-alive event every keepalive_seconds.
+    """
+    keepalive_seconds = float(os.getenv('MOCK_KEEPALIVE_SECONDS', '30'))
+    
+    def __init__(self, data, keys, callback):
+        self.data = data
+        self.keys = keys
+        self.callback = callback
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._keep_alive, daemon=True)
+        self._thread.start()
+    
+    def _keep_alive(self):
+        while not self._closed.wait(self.keepalive_seconds):
+            self.callback(MockEvent('keep-alive', None, None))
+    
+    def emit(self, event_type, path, data):
+        if not self._closed.is_set():
+            self.callback(MockEvent(event_type, path, copy.deepcopy(data)))
+    
+    def close(self):
+        self._closed.set()
+        with _mock_listeners_lock:
+            if self in _mock_listeners:
+                _mock_listeners.remove(self)
+
+def _emit_mock_events(data, keys, event_type, value):
+    """Send a write to every listener on, above or below the written path"""
+    with _mock_listeners_lock:
+        listeners = [listener for listener in _mock_listeners if listener.data is data]
+    for listener in listeners:
+        depth = len(listener.keys)
+        if keys[:depth] == listener.keys:
+            listener.emit(event_type, '/' + '/'.join(keys[depth:]), value)
+        elif listener.keys[:len(keys)] == keys:
+            listener.emit('put', '/', MockDatabaseRef(data, '/'.join(listener.keys)).get())
+
 class MockDatabase:
     """Mock database for development"""
     def __init__(self):
@@ -82,37 +148,63 @@ class MockDatabaseRef:
         return current
     
     def push(self):
-        import uuid
-        new_id = str(uuid.uuid4())[:8]
-        return MockPushRef(self.data, self.keys, new_id)
+        # Time-ordered like Firebase push ids
+        return MockPushRef(self.data, self.keys, generate_push_id())
     
     def set(self, value):
-        current = self.data
-        for key in self.keys[:-1]:
-            if key not in current:
-                current[key] = {}
-            current = current[key]
         if self.keys:
-            current[self.keys[-1]] = value
+            value = resolve_server_values(value, self.get())
+            put_value(self.data, self.keys, value)
+            _emit_mock_events(self.data, self.keys, 'put', value)
     
     def update(self, value):
-        current = self.data
-        for key in self.keys:
-            if key not in current:
-                current[key] = {}
-            current = current[key]
-        current.update(value)
+        """Multi-location update: keys may be paths, None deletes and server values
+        (e.g. increments) are applied, like Reference.update"""
+        with _mock_transaction_lock:
+            resolved = {}
+            for key, item in value.items():
+                keys = self.keys + split_path(key)
+                resolved[key] = resolve_server_values(item, get_value(self.data, keys))
+                put_value(self.data, keys, resolved[key])
+        _emit_mock_events(self.data, self.keys, 'patch', resolved)
+    
+    def listen(self, callback):
+        """Stream changes under this path to callback, like Reference.listen
+        The first event is a put of the current value at '/'
+        """
+        registration = MockListenerRegistration(self.data, self.keys, callback)
+        with _mock_listeners_lock:
+            _mock_listeners.append(registration)
+        registration.emit('put', '/', self.get())
+        return registration
+    
+    def order_by_child(self, path):
+        return Query(self, 'child', path)
+    
+    def order_by_key(self):
+        return Query(self, 'key')
+    
+    def order_by_value(self):
+        return Query(self, 'value')
+    
+    def _run_query(self, query):
+        """Ordered queries are evaluated in memory, with Firebase's ordering rules"""
+        return query.evaluate(self.get())
+    
+    def transaction(self, transaction_update):
+        """Apply transaction_update to the current value atomically, like Reference.transaction"""
+        with _mock_transaction_lock:
+            new_value = transaction_update(self.get())
+            if new_value is None:
+                self.delete()
+            else:
+                self.set(new_value)
+            return new_value
     
     def delete(self):
-        if len(self.keys) > 0:
-            current = self.data
-            for key in self.keys[:-1]:
-                if key in current:
-                    current = current[key]
-                else:
-                    return
-            if self.keys[-1] in current:
-                del current[self.keys[-1]]
+        if self.keys and self.get() is not None:
+            put_value(self.data, self.keys, None)
+            _emit_mock_events(self.data, self.keys, 'put', None)
 
 class MockPushRef:
     def __init__(self, data, parent_keys, new_id):
@@ -120,43 +212,150 @@ class MockPushRef:
         self.parent_keys = parent_keys
         self.new_id = new_id
     
+    @property
+    def key(self):
+        return self.new_id
+    
     def set(self, value):
-        current = self.data
-        for key in self.parent_keys:
-            if key not in current:
-                current[key] = {}
-            current = current[key]
-        current[self.new_id] = value
+        value = resolve_server_values(value, None)
+        put_value(self.data, self.parent_keys + [self.new_id], value)
+        _emit_mock_events(self.data, self.parent_keys + [self.new_id], 'put', value)
 
 # Global mock database instance
 _mock_db = MockDatabase()
 
-def get_db():
-    """Get Firebase Realtime Database reference"""
-    # Check if we have real Firebase connection
-    project_id = os.getenv('FIREBASE_PROJECT_ID')
-    private_key = os.getenv('FIREBASE_PRIVATE_KEY')
-    client_email = os.getenv('FIREBASE_CLIENT_EMAIL')
+class DatabaseManager:
+    """Process-wide database handle
+    
+    The backend is real Firebase when configured and the mock otherwise,
+    unless DATABASE_BACKEND selects sqlite (a durable file shared by all
+    workers, see app.config.sqlite_database) or mock. It is resolved on first
+    use and then reused, so get_db() is cheap enough to call on every request. A fork
+    (gunicorn workers with preload_app) is detected by pid and resolves again,
+    so each worker gets its own HTTP sessions and replica streams.
+    firebase_admin keeps one keep-alive session per database URL, so reusing
+    the resolved root reuses its connections.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = None
+        self._backend_root = None
+        self._pid = None
+        self.backend = None
+        self.reason = ''
+        self.resolved_at = None
+        # Result of the last health probe
+        self._probe = None
+        self._probe_at = 0.0
+        self.health_check_interval = float(os.getenv('DB_HEALTH_CHECK_SECONDS', '30'))
+    
+    def get(self):
+        root = self._root
+        if root is not None and self._pid == os.getpid():
+            return root
+        with self._lock:
+            if self._root is None or self._pid != os.getpid():
+                self._resolve()
+            return self._root
     
-    # Debug credentials
-    print(f"🔍 Debug credentials: project_id={bool(project_id)}, private_key={bool(private_key)}, client_email={bool(client_email)}")
-    print(f"🔍 Firebase apps initialized: {bool(firebase_admin._apps)}")
+    def reset(self):
+        """Resolve again on next use, e.g. after Firebase was initialized"""
+        with self._lock:
+            self._root = None
+            self._probe = None
     
-    if project_id and private_key and client_email and firebase_admin._apps:
+    def _resolve(self):
+        forked = self._pid is not None and self._pid != os.getpid()
+        requested = os.getenv('DATABASE_BACKEND', 'auto').lower()
+        
+        root = None
+        if requested == 'sqlite':
+            try:
+                root = SQLiteDatabase(SQLITE_DATABASE_PATH)
+                self.backend, self.reason = 'sqlite', ''
+                print(f"🗄️ Using SQLite database {SQLITE_DATABASE_PATH} (pid {os.getpid()})")
+            except Exception as e:
+                self.reason = f'Error opening SQLite database: {e}'
+                print(f"❌ {self.reason}, falling back to mock")
+        elif requested == 'mock':
+            self.reason = 'DATABASE_BACKEND=mock'
+            print(f"⚠️ Using mock database (pid {os.getpid()}) - {self.reason}")
+        else:
+            missing = [name for name in ('FIREBASE_PROJECT_ID', 'FIREBASE_PRIVATE_KEY', 'FIREBASE_CLIENT_EMAIL')
+                       if not os.getenv(name)]
+            if not firebase_admin._apps:
+                missing.append('Firebase not initialized')
+            
+            if not missing:
+                try:
+                    if forked:
+                        self._drop_inherited_clients()
+                    root = db.reference()
+                    self.backend, self.reason = 'firebase', ''
+                    print(f"🔥 Using REAL Firebase database (pid {os.getpid()})")
+                except Exception as e:
+                    self.reason = f'Error getting Firebase DB: {e}'
+                    print(f"❌ {self.reason}, falling back to mock")
+            else:
+                self.reason = 'Missing: ' + ', '.join(missing)
+                print(f"⚠️ Using mock database (pid {os.getpid()}) - {self.reason}")
+        
+        if root is None:
+            root = _mock_db
+            self.backend = 'mock'
+        self._backend_root = root
+        # Only Firebase is remote; local backends gain nothing from a mirror
+        if replica_enabled(self.backend):
+            root = live_replica.wrap(root)
+        
+        self._root = root
+        self._pid = os.getpid()
+        self._probe = None
+        self.resolved_at = datetime.now(timezone(timedelta(hours=7))).isoformat()
+    
+    @staticmethod
+    def _drop_inherited_clients():
+        """Forget the database clients (and their pooled sockets) a parent process created"""
         try:
-            print("🔥 Using REAL Firebase database!")
-            return db.reference()  # Real Firebase database
+            services = getattr(firebase_admin.get_app(), '_services', None)
+            if isinstance(services, dict):
+                services.pop('_database', None)
         except Exception as e:
-            print(f"❌ Error getting Firebase DB: {e}, falling back to mock")
-            return _mock_db
-    else:
-        print("⚠️ Using mock database - Firebase credentials not complete")
-        if not project_id:
-            print("   Missing FIREBASE_PROJECT_ID")
-        if not private_key:
-            print("   Missing FIREBASE_PRIVATE_KEY")
-        if not client_email:
-            print("   Missing FIREBASE_CLIENT_EMAIL")
-        if not firebase_admin._apps:
-            print("   Firebase not initialized")
-        return _mock_db  # Mock database for development
\ No newline at end of file
+            print(f"⚠️ Could not reset inherited Firebase clients: {e}")
+    
+    def health(self) -> dict:
+        """Backend in use and the result of a small timed read, probed at most every health_check_interval"""
+        root = self.get()
+        now = time.monotonic()
+        probe = self._probe
+        if probe is None or now - self._probe_at >= self.health_check_interval:
+            started = time.perf_counter()
+            try:
+                # Bypass the replica so the probe measures the database itself
+                self._backend_root.child('knowledge_meta').child('version').get()
+                probe = {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 1), 'error': None}
+            except Exception as e:
+                probe = {'ok': False, 'latency_ms': None, 'error': str(e)}
+            self._probe, self._probe_at = probe, now
+        
+        return {
+            'backend': self.backend,
+            'reason': self.reason,
+            'pid': self._pid,
+            'resolved_at': self.resolved_at,
+            'replica': isinstance(root, ReplicatedRef),
+            'checked_seconds_ago': round(now - self._probe_at, 1),
+            **probe
+        }
+
+# Global database manager
+database = DatabaseManager()
+
+def get_db():
+    """Get Firebase Realtime Database reference
+    
+    Reads of hot paths are served from the live replica when it is enabled
+    (see app.config.replica); writes always go to the database.
+    """
+    return database.get()
@@ -0,0 +1,401 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.config.db_tree import Query, clone, get_value, has_server_values, put_value, split_path
+
+# Paths mirrored in memory. Each one is a separate listen() stream (an open
+# connection per worker), so keep this to the nodes read on request paths.
+# `<collection>_meta/version` is never mirrored: separate streams aren't ordered
+# against each other, so a mirrored version could arrive before the data it
+# versions. It is read from the database and gates the collection's mirror.
+DEFAULT_REPLICA_PATHS = 'knowledge,announcements,schedules,analytics/realtime'
+
+# The server sends a keep-alive about every 30s; without any event for this
+# long a mirror stops serving reads and requests go to the database again
+REPLICA_MAX_STALENESS_SECONDS = float(os.getenv('REPLICA_MAX_STALENESS_SECONDS', '90'))
+
+# A stream that stays silent this long is closed and reopened
+REPLICA_RESTART_SECONDS = float(os.getenv('REPLICA_RESTART_SECONDS', '180'))
+
+
+class MirrorNode:
+    """In-memory copy of one database path, kept current by a listen() stream"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.keys = split_path(path)
+        self.value = None
+        self.synced = False
+        self.lock = threading.Lock()
+        self.registration = None
+        self.starting = False
+        self.started_at: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+        self.events = 0
+        self.resyncs = 0
+        self.reads = 0
+        self.fallbacks = 0
+        # Newest `<path>_meta/version` this worker has seen, and the one the
+        # mirror is known to hold the data of; reads wait for them to match
+        self.latest_version = None
+        self.confirmed_version = None
+        self.catch_up_lock = threading.Lock()
+        self.catch_ups = 0
+
+    def on_event(self, event):
+        """listen() callback; must never raise or the stream thread dies"""
+        try:
+            event_type = event.event_type
+            with self.lock:
+                self.last_event_at = time.monotonic()
+                if event_type in ('put', 'patch'):
+                    self._apply(event_type, event.path, event.data)
+                    self.events += 1
+                    if event_type == 'put' and not split_path(event.path):
+                        # Full snapshot: sent first, and again after every reconnect
+                        self.synced = True
+                        self.resyncs += 1
+                elif event_type in ('cancel', 'auth_revoked'):
+                    print(f"⚠️ Replica stream for {self.path} ended: {event_type}")
+                    self.synced = False
+        except Exception as e:
+            print(f"⚠️ Replica could not apply event on {self.path}: {e}")
+            with self.lock:
+                self.synced = False
+
+    def apply(self, event_type: str, path: str, data: Any):
+        """Apply a write made by this process, before the stream echoes it back
+
+        Writes with server values (increments) are left to the stream: only
+        the server knows the value they produce.
+        """
+        if has_server_values(data):
+            return
+        with self.lock:
+            if self.synced:
+                self._apply(event_type, path, clone(data))
+
+    def _apply(self, event_type: str, path: str, data: Any):
+        keys = split_path(path)
+        if event_type == 'put':
+            self.value = put_value(self.value, keys, data)
+        else:
+            for key, item in (data or {}).items():
+                self.value = put_value(self.value, keys + split_path(key), item)
+
+    def age(self) -> Optional[float]:
+        return None if self.last_event_at is None else time.monotonic() - self.last_event_at
+
+    def is_fresh(self) -> bool:
+        age = self.age()
+        return self.synced and age is not None and age < REPLICA_MAX_STALENESS_SECONDS
+
+    def is_current(self) -> bool:
+        return self.confirmed_version == self.latest_version
+
+    def read(self, keys: List[str]) -> Tuple[bool, Any]:
+        with self.lock:
+            if not self.is_fresh() or not self.is_current():
+                self.fallbacks += 1
+                return False, None
+            self.reads += 1
+            return True, clone(get_value(self.value, keys))
+
+    def confirm(self, version, value) -> bool:
+        """Mark the mirror current at version if it holds value, the database's data read after that version"""
+        with self.lock:
+            if self.latest_version != version or not self.is_fresh() or self.value != value:
+                return False
+            self.confirmed_version = version
+            return True
+
+    def status(self) -> Dict:
+        age = self.age()
+        return {
+            'path': self.path,
+            'listening': self.registration is not None,
+            'synced': self.synced,
+            'fresh': self.is_fresh(),
+            'age_seconds': None if age is None else round(age, 1),
+            'events': self.events,
+            'resyncs': self.resyncs,
+            'local_reads': self.reads,
+            'fallback_reads': self.fallbacks,
+            'version_current': self.is_current(),
+            'catch_up_reads': self.catch_ups
+        }
+
+
+class LiveReplica:
+    """Per-worker mirrors of hot database paths, fed by listen() streams
+
+    Streams open lazily on the first read of a path, so each forked worker
+    opens its own; until the first snapshot arrives, or when a stream goes
+    quiet, reads go to the database as before.
+
+    A mirrored collection's `<collection>_meta/version` is read from the
+    database. After a new version is seen, the collection is read from the
+    database until the mirror holds the same data, so nothing tagged with a
+    version (search index, ETags) is built from data older than it.
+    """
+
+    def __init__(self, paths: List[str]):
+        self.paths = [path for path in (('/'.join(split_path(p))) for p in paths) if path]
+        self._root = None
+        self._mirrors: Dict[str, MirrorNode] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def wrap(self, root):
+        """Database root whose reads of mirrored paths are served locally"""
+        self._root = root
+        return ReplicatedRef(root, '', self)
+
+    def _mirror_for(self, keys: List[str]) -> Tuple[Optional[MirrorNode], List[str]]:
+        """Mirror covering keys (the deepest one) and the keys below it"""
+        best = None
+        for path in self.paths:
+            mirror_keys = split_path(path)
+            if keys[:len(mirror_keys)] == mirror_keys and (best is None or len(mirror_keys) > len(split_path(best))):
+                best = path
+        if best is None:
+            return None, []
+        return self._get_mirror(best), keys[len(split_path(best)):]
+
+    def _get_mirror(self, path: str) -> MirrorNode:
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Forked: the parent's stream threads don't exist here
+                self._mirrors = {}
+                self._pid = os.getpid()
+            mirror = self._mirrors.get(path)
+            if mirror is None:
+                mirror = self._mirrors[path] = MirrorNode(path)
+            return mirror
+
+    def _versioned_mirror(self, keys: List[str]) -> Optional[MirrorNode]:
+        """Mirror of the collection whose version node keys points at, if that collection is mirrored"""
+        if len(keys) != 2 or keys[1] != 'version' or not keys[0].endswith('_meta'):
+            return None
+        collection = keys[0][:-len('_meta')]
+        return self._get_mirror(collection) if collection in self.paths else None
+
+    def read(self, path: str) -> Tuple[bool, Any]:
+        """(served, value) for a read at path; served is False when the caller must go to the database"""
+        keys = split_path(path)
+        if self._versioned_mirror(keys) is not None:
+            return False, None
+        mirror, below = self._mirror_for(keys)
+        if mirror is None:
+            return False, None
+        self._ensure_listening(mirror)
+        served, value = mirror.read(below)
+        if not served and mirror.is_fresh() and not mirror.is_current():
+            return self._catch_up(mirror, below)
+        return served, value
+
+    def _catch_up(self, mirror: MirrorNode, below: List[str]) -> Tuple[bool, Any]:
+        """Answer from the database while the mirror is behind the newest version, confirming it when it has caught up
+
+        The version was bumped after its data was written, so a read made
+        after seeing the version holds at least that data.
+        """
+        with mirror.catch_up_lock:
+            # Another thread may have confirmed the mirror while this one waited
+            served, value = mirror.read(below)
+            if served:
+                return served, value
+            version = mirror.latest_version
+            value = self._root.child(mirror.path).get()
+            mirror.catch_ups += 1
+            mirror.confirm(version, value)
+            return True, get_value(value, below)
+
+    def observe_version(self, path: str, version: Any):
+        """Record a version read from or written to the database"""
+        mirror = self._versioned_mirror(split_path(path))
+        if mirror is not None:
+            with mirror.lock:
+                mirror.latest_version = version
+
+    def apply_local(self, event_type: str, path: str, value: Any):
+        """Mirror a write made through ReplicatedRef on every affected path"""
+        keys = split_path(path)
+        if event_type == 'patch':
+            for key, item in (value or {}).items():
+                self.apply_local('put', '/'.join(keys + split_path(key)), item)
+            return
+        self.observe_version(path, value)
+        for mirror_path in self.paths:
+            mirror_keys = split_path(mirror_path)
+            if keys[:len(mirror_keys)] == mirror_keys:
+                self._get_mirror(mirror_path).apply('put', '/'.join(keys[len(mirror_keys):]), value)
+            elif mirror_keys[:len(keys)] == keys:
+                self._get_mirror(mirror_path).apply('put', '', get_value(value, mirror_keys[len(keys):]))
+
+    def _ensure_listening(self, mirror: MirrorNode):
+        now = time.monotonic()
+        with self._lock:
+            if mirror.starting:
+                return
+            silent_for = now - (mirror.last_event_at or mirror.started_at or now)
+            if mirror.registration is not None and silent_for < REPLICA_RESTART_SECONDS:
+                return
+            if mirror.registration is None and mirror.started_at is not None \
+                    and now - mirror.started_at < REPLICA_RESTART_SECONDS:
+                return  # A recent start failed; don't retry on every read
+            mirror.starting = True
+            mirror.started_at = now
+
+        old_registration, mirror.registration = mirror.registration, None
+        threading.Thread(target=self._listen, args=(mirror, old_registration), daemon=True).start()
+
+    def _listen(self, mirror: MirrorNode, old_registration):
+        """Open the stream off the request thread (connecting blocks)"""
+        try:
+            if old_registration is not None:
+                print(f"🔄 Replica stream for {mirror.path} went quiet, reconnecting")
+                with mirror.lock:
+                    mirror.synced = False
+                old_registration.close()
+            mirror.registration = self._root.child(mirror.path).listen(mirror.on_event)
+            print(f"📡 Replica listening on {mirror.path}")
+        except Exception as e:
+            print(f"⚠️ Replica could not listen on {mirror.path}: {e}")
+        finally:
+            mirror.starting = False
+
+    def close(self):
+        """Close every stream; their threads would otherwise keep the process alive"""
+        with self._lock:
+            mirrors = list(self._mirrors.values()) if os.getpid() == self._pid else []
+        for mirror in mirrors:
+            registration, mirror.registration = mirror.registration, None
+            if registration is not None:
+                try:
+                    registration.close()
+                except Exception as e:
+                    print(f"⚠️ Error closing replica stream for {mirror.path}: {e}")
+
+    def status(self) -> Dict:
+        with self._lock:
+            mirrors = dict(self._mirrors) if os.getpid() == self._pid else {}
+        return {
+            'paths': self.paths,
+            'max_staleness_seconds': REPLICA_MAX_STALENESS_SECONDS,
+            'mirrors': [mirrors[path].status() if path in mirrors else MirrorNode(path).status()
+                        for path in self.paths]
+        }
+
+
+class ReplicatedRef:
+    """Database reference that reads mirrored paths from the replica and writes through"""
+
+    def __init__(self, ref, path: str, replica: LiveReplica):
+        self._ref = ref
+        self._path = path
+        self._replica = replica
+
+    def child(self, path: str) -> 'ReplicatedRef':
+        child_path = '/'.join(split_path(self._path) + split_path(path))
+        return ReplicatedRef(self._ref.child(path), child_path, self._replica)
+
+    @property
+    def key(self):
+        return self._ref.key
+
+    def get(self, *args, **kwargs):
+        if not args and not kwargs:
+            served, value = self._replica.read(self._path)
+            if served:
+                return value
+            value = self._ref.get()
+            self._replica.observe_version(self._path, value)
+            return value
+        return self._ref.get(*args, **kwargs)
+
+    def set(self, value):
+        self._ref.set(value)
+        self._replica.apply_local('put', self._path, value)
+
+    def update(self, value):
+        self._ref.update(value)
+        self._replica.apply_local('patch', self._path, value)
+
+    def delete(self):
+        self._ref.delete()
+        self._replica.apply_local('put', self._path, None)
+
+    def push(self, *args, **kwargs) -> 'ReplicatedRef':
+        new_ref = self._ref.push(*args, **kwargs)
+        return ReplicatedRef(new_ref, '/'.join(split_path(self._path) + [new_ref.key]), self._replica)
+
+    def transaction(self, transaction_update):
+        result = self._ref.transaction(transaction_update)
+        self._replica.apply_local('put', self._path, result)
+        return result
+
+    def order_by_child(self, path: str) -> Query:
+        return Query(self, 'child', path)
+
+    def order_by_key(self) -> Query:
+        return Query(self, 'key')
+
+    def order_by_value(self) -> Query:
+        return Query(self, 'value')
+
+    def _run_query(self, query: Query) -> Dict:
+        """Answer from the mirror when it is fresh, else run the same query on the database"""
+        served, value = self._replica.read(self._path)
+        if served:
+            return query.evaluate(value)
+        if query.order_by == 'child':
+            backend_query = self._ref.order_by_child('/'.join(query.child_keys))
+        elif query.order_by == 'key':
+            backend_query = self._ref.order_by_key()
+        else:
+            backend_query = self._ref.order_by_value()
+        if query.start is not None:
+            backend_query = backend_query.start_at(query.start)
+        if query.end is not None:
+            backend_query = backend_query.end_at(query.end)
+        if query.limit_first is not None:
+            backend_query = backend_query.limit_to_first(query.limit_first)
+        if query.limit_last is not None:
+            backend_query = backend_query.limit_to_last(query.limit_last)
+        return backend_query.get()
+
+    def __getattr__(self, name):
+        # listen() and anything else go straight to the database
+        return getattr(self._ref, name)
+
+
+def _replica_mode() -> str:
+    return os.getenv('FIREBASE_REPLICA', 'auto').lower()
+
+
+def replica_enabled(backend: str) -> bool:
+    """FIREBASE_REPLICA=auto (default) mirrors the real database only; true also mirrors the mock
+
+    The SQLite backend can't stream changes, so it is never mirrored.
+    """
+    if backend == 'sqlite':
+        return False
+    mode = _replica_mode()
+    if mode in ('true', '1', 'yes'):
+        return True
+    if mode in ('false', '0', 'no'):
+        return False
+    return backend == 'firebase'
+
+
+live_replica = LiveReplica(os.getenv('REPLICA_PATHS', DEFAULT_REPLICA_PATHS).split(','))
+
+# Close streams before the interpreter waits on non-daemon threads at exit
+# (firebase_admin's listener threads are not daemons)
+if hasattr(threading, '_register_atexit'):
+    threading._register_atexit(live_replica.close)
+else:
+    import atexit
+    atexit.register(live_replica.close)
@@ -0,0 +1,344 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from app.config.db_tree import (RANK_OBJECT, Query, as_dict, generate_push_id, has_server_values, key_order,
+                                resolve_server_values, sort_key, split_path)
+
+# Where DATABASE_BACKEND=sqlite keeps its data; every worker on the host shares the file
+SQLITE_DATABASE_PATH = os.getenv('SQLITE_DATABASE_PATH', 'data/tanyaunpra.sqlite3')
+
+# How long a writer waits for another process's write transaction to finish
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv('SQLITE_BUSY_TIMEOUT_SECONDS', '5'))
+
+# One row per node of the JSON tree. Objects are rows with rank RANK_OBJECT and
+# no value; leaves hold their JSON value plus (rank, num, txt), Firebase's
+# ordering of it; (key_rank, key_num) is the Firebase ordering of the parent's
+# key, which breaks ties. The primary key makes every subtree a contiguous path
+# range, nodes_by_parent lists children and nodes_by_child_value answers
+# order_by_child queries (children of `grandparent` ordered by leaf `name`).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    grandparent TEXT,
+    name TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    num REAL NOT NULL DEFAULT 0,
+    txt TEXT NOT NULL DEFAULT '',
+    key_rank INTEGER NOT NULL DEFAULT 1,
+    key_num INTEGER NOT NULL DEFAULT 0,
+    value TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS nodes_by_parent ON nodes (parent, name);
+CREATE INDEX IF NOT EXISTS nodes_by_child_value ON nodes (grandparent, name, rank, num, txt, key_rank, key_num, parent);
+"""
+
+
+def _join(*parts: str) -> str:
+    return '/'.join(key for part in parts for key in split_path(part))
+
+
+def _parent_of(path: str) -> str:
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+
+def _subtree_clause(path: str):
+    """WHERE clause and parameters matching path and everything below it"""
+    if not path:
+        return '1', ()
+    # '0' follows '/' in ASCII, so [path/, path0) is exactly the descendants
+    return 'path = ? OR (path >= ? AND path < ?)', (path, path + '/', path + '0')
+
+
+def _arrays(value: Any) -> Any:
+    """Turn objects with dense integer keys back into lists, as Firebase returns them"""
+    if not isinstance(value, dict):
+        return value
+    value = {key: _arrays(item) for key, item in value.items()}
+    if all(key.isdigit() and key == str(int(key)) for key in value):
+        size = max(int(key) for key in value) + 1
+        if size <= 2 * len(value):
+            return [value.get(str(i)) for i in range(size)]
+    return value
+
+
+class SQLiteDatabase:
+    """Firebase-shaped JSON tree stored in SQLite in WAL mode
+
+    A durable local backend: data survives restarts, gunicorn workers share
+    one file (WAL lets readers run alongside the single writer), and ordered
+    queries are answered from indexes instead of loading whole collections.
+    Connections are per thread and per process, so it is safe with gthread
+    workers and preload forks.
+    """
+
+    def __init__(self, path: str = SQLITE_DATABASE_PATH):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Durable across process crashes; only an OS crash can lose the last commits
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def write(self):
+        """Write transaction; BEGIN IMMEDIATE takes the write lock up front so
+        read-modify-write sequences can't interleave with other processes"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def snapshot(self):
+        """Read transaction, so multi-statement reads see one consistent state"""
+        conn = self.connection()
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def child(self, path: str) -> 'SQLiteRef':
+        return SQLiteRef(self, _join(path))
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    # Tree operations; all take a connection inside a transaction
+
+    @staticmethod
+    def _read(conn: sqlite3.Connection, path: str) -> Any:
+        clause, params = _subtree_clause(path)
+        root: Dict[str, Any] = {}
+        found = False
+        offset = len(path) + 1 if path else 0
+        for row_path, rank, value in conn.execute(f'SELECT path, rank, value FROM nodes WHERE {clause}', params):
+            found = True
+            keys = row_path[offset:].split('/') if row_path != path else []
+            if not keys:
+                if rank != RANK_OBJECT:
+                    return json.loads(value)
+                continue
+            node = root
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            if rank == RANK_OBJECT:
+                node.setdefault(keys[-1], {})
+            else:
+                node[keys[-1]] = json.loads(value)
+        return _arrays(root) if found else None
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, path: str):
+        clause, params = _subtree_clause(path)
+        conn.execute(f'DELETE FROM nodes WHERE {clause}', params)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, path: str, value: Any) -> bool:
+        """Insert the rows of value at path; False when there was nothing to store"""
+        if isinstance(value, (dict, list)):
+            stored = False
+            for key, item in as_dict(value).items():
+                if item is not None:
+                    stored = SQLiteDatabase._insert(conn, _join(path, str(key)), item) or stored
+            if not stored:
+                return False
+            rank, num, txt, encoded = RANK_OBJECT, 0.0, '', None
+        else:
+            rank, num, txt = sort_key(value)
+            encoded = json.dumps(value)
+        parent = _parent_of(path)
+        key_rank, key_num, _ = key_order(parent.rsplit('/', 1)[-1])
+        conn.execute(
+            'INSERT INTO nodes (path, parent, grandparent, name, rank, num, txt, key_rank, key_num, value) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, parent, _parent_of(parent) if parent else None, path.rsplit('/', 1)[-1],
+             rank, num, txt, key_rank, key_num, encoded)
+        )
+        return True
+
+    @staticmethod
+    def _ensure_ancestors(conn: sqlite3.Connection, path: str):
+        keys = split_path(path)
+        for depth in range(1, len(keys)):
+            ancestor = '/'.join(keys[:depth])
+            parent = _parent_of(ancestor)
+            key_rank, key_num, _ = key_order(parent.rsplit('/', 1)[-1])
+            # A leaf in the way becomes an object, as in Firebase
+            conn.execute(
+                'INSERT INTO nodes (path, parent, grandparent, name, rank, key_rank, key_num) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(path) DO UPDATE SET rank = excluded.rank, num = 0, txt = \'\', value = NULL '
+                'WHERE nodes.rank != excluded.rank',
+                (ancestor, parent, _parent_of(parent) if parent else None, keys[depth - 1],
+                 RANK_OBJECT, key_rank, key_num)
+            )
+
+    @staticmethod
+    def _prune(conn: sqlite3.Connection, path: str):
+        """Remove ancestors left without children"""
+        ancestor = _parent_of(path)
+        while ancestor:
+            if conn.execute('SELECT 1 FROM nodes WHERE parent = ? LIMIT 1', (ancestor,)).fetchone():
+                return
+            conn.execute('DELETE FROM nodes WHERE path = ?', (ancestor,))
+            ancestor = _parent_of(ancestor)
+
+    @staticmethod
+    def _set(conn: sqlite3.Connection, path: str, value: Any):
+        if has_server_values(value):
+            # Resolved inside the write transaction, so increments are atomic
+            value = resolve_server_values(value, SQLiteDatabase._read(conn, path))
+        SQLiteDatabase._delete(conn, path)
+        if value is not None and SQLiteDatabase._insert(conn, path, value):
+            SQLiteDatabase._ensure_ancestors(conn, path)
+        else:
+            SQLiteDatabase._prune(conn, path)
+
+
+class SQLiteRef:
+    """Reference into a SQLiteDatabase with the firebase_admin.db.Reference API"""
+
+    def __init__(self, database: SQLiteDatabase, path: str):
+        self._database = database
+        self.path = path
+
+    @property
+    def key(self) -> Optional[str]:
+        return self.path.rsplit('/', 1)[-1] if self.path else None
+
+    def child(self, path: str) -> 'SQLiteRef':
+        return SQLiteRef(self._database, _join(self.path, path))
+
+    def get(self):
+        return SQLiteDatabase._read(self._database.connection(), self.path)
+
+    def set(self, value):
+        with self._database.write() as conn:
+            SQLiteDatabase._set(conn, self.path, value)
+
+    def update(self, value: Dict):
+        if not isinstance(value, dict):
+            raise ValueError('Value argument must be a dict')
+        with self._database.write() as conn:
+            for key, item in value.items():
+                SQLiteDatabase._set(conn, _join(self.path, key), item)
+
+    def delete(self):
+        with self._database.write() as conn:
+            SQLiteDatabase._set(conn, self.path, None)
+
+    def push(self, value=None) -> 'SQLiteRef':
+        ref = self.child(generate_push_id())
+        if value is not None:
+            ref.set(value)
+        return ref
+
+    def transaction(self, transaction_update):
+        """Apply transaction_update to the current value under the database write lock"""
+        with self._database.write() as conn:
+            new_value = transaction_update(SQLiteDatabase._read(conn, self.path))
+            SQLiteDatabase._set(conn, self.path, new_value)
+            return new_value
+
+    def order_by_child(self, path: str) -> Query:
+        return Query(self, 'child', path)
+
+    def order_by_key(self) -> Query:
+        return Query(self, 'key')
+
+    def order_by_value(self) -> Query:
+        return Query(self, 'value')
+
+    def _run_query(self, query: Query) -> Dict:
+        with self._database.snapshot() as conn:
+            if query.order_by == 'key':
+                keys = self._ordered_keys(conn, query)
+            elif query.order_by == 'child' and len(query.child_keys) == 1:
+                keys = self._ordered_children(conn, query)
+            else:
+                # Values and nested child paths have no index; order in memory
+                return query.evaluate(SQLiteDatabase._read(conn, self.path))
+            result = {}
+            for key in keys:
+                value = SQLiteDatabase._read(conn, _join(self.path, key))
+                if value is not None:
+                    result[key] = value
+            return result
+
+    def _ordered_keys(self, conn: sqlite3.Connection, query: Query) -> List[str]:
+        # Child names come from the index alone; only the selected children are read
+        keys = sorted((name for (name,) in conn.execute('SELECT name FROM nodes WHERE parent = ?', (self.path,))),
+                      key=key_order)
+        if query.start is not None:
+            keys = [key for key in keys if key_order(key) >= key_order(query.start)]
+        if query.end is not None:
+            keys = [key for key in keys if key_order(key) <= key_order(query.end)]
+        if query.limit_first is not None:
+            keys = keys[:query.limit_first]
+        if query.limit_last is not None:
+            keys = keys[max(0, len(keys) - query.limit_last):]
+        return keys
+
+    def _ordered_children(self, conn: sqlite3.Connection, query: Query) -> List[str]:
+        """Children ordered by one child value (then by key), read from nodes_by_child_value"""
+        name = query.child_keys[0]
+        where, params = ['grandparent = ?', 'name = ?'], [self.path, name]
+        if query.start is not None:
+            where.append('(rank, num, txt) >= (?, ?, ?)')
+            params.extend(sort_key(query.start))
+        if query.end is not None:
+            where.append('(rank, num, txt) <= (?, ?, ?)')
+            params.extend(sort_key(query.end))
+        last = query.limit_last is not None
+        limit = query.limit_last if last else query.limit_first
+        direction = ' DESC' if last else ''
+        sql = (f'SELECT parent FROM nodes WHERE {" AND ".join(where)} '
+               f'ORDER BY rank{direction}, num{direction}, txt{direction}, '
+               f'key_rank{direction}, key_num{direction}, parent{direction}')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        offset = len(self.path) + 1 if self.path else 0
+        keys = [parent[offset:] for (parent,) in conn.execute(sql, params)]
+        if last:
+            keys.reverse()
+
+        # Children without the value sort first (as null), so they belong in
+        # the result only when there is no start bound and the limit has room
+        if query.start is None and (limit is None or len(keys) < limit or not last):
+            missing = sorted(
+                (child for (child,) in conn.execute(
+                    'SELECT name FROM nodes WHERE parent = ? AND path NOT IN '
+                    '(SELECT parent FROM nodes WHERE grandparent = ? AND name = ?)',
+                    (self.path, self.path, name))),
+                key=key_order
+            )
+            if limit is None:
+                keys = missing + keys
+            elif last:
+                keys = missing[max(0, len(missing) - (limit - len(keys))):] + keys
+            else:
+                keys = (missing + keys)[:limit]
+        return keys
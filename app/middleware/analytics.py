@@ -30,7 +30,7 @@ def track_api_request(f):
         else:
             g.status_code = 200
         
-        # Log analytics after response (non-blocking)
+        # Queue analytics; a background thread writes them in batches
         try:
             from app.services.analytics_service import analytics_service
             analytics_service.log_request(
@@ -0,0 +1,40 @@
+import hashlib
+from functools import wraps
+from typing import Callable, Optional
+from flask import request, make_response
+
+def conditional_get(collection: str, vary: Optional[Callable[[], str]] = None):
+    """Decorator adding a strong ETag to a public GET and answering If-None-Match with 304
+
+    The tag comes from the collection's version token and the request URL, so
+    an unchanged collection is answered after one small read instead of a full
+    download, normalization and JSON encoding. `vary` adds anything else the
+    response depends on (e.g. today's date for stats).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+
+            from app.config.firebase_config import get_db
+            from app.services.collection_version import get_collection_version
+            version = get_collection_version(get_db(), collection)
+            if version is None:
+                return f(*args, **kwargs)
+
+            key = f"{request.full_path}|{vary() if vary else ''}"
+            etag = f"{collection}-{version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Clients may keep the body but must revalidate before using it
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
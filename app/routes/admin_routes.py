@@ -7,6 +7,10 @@ from app.middleware.auth import login_required, check_admin_credentials
 
 admin_bp = Blueprint('admin', __name__)
 
+# First page of the knowledge management table; the rest is fetched on demand
+KNOWLEDGE_PAGE_SIZE = int(os.getenv('ADMIN_KNOWLEDGE_PAGE_SIZE', '50'))
+KNOWLEDGE_PAGE_FIELDS = ['question', 'answer', 'category', 'keywords', 'created_at']
+
 @admin_bp.route('/')
 def landing():
     """Public landing page"""
@@ -55,10 +59,15 @@ def dashboard():
 def knowledge_management():
     """Knowledge management page"""
     try:
-        knowledge_list = knowledge_service.get_all_knowledge()
-        return render_template('knowledge.html', knowledge_list=knowledge_list)
+        page = knowledge_service.list_knowledge(
+            limit=KNOWLEDGE_PAGE_SIZE, fields=KNOWLEDGE_PAGE_FIELDS, order_by='updated_at', order='desc'
+        )
+        return render_template('knowledge.html', knowledge_list=page['items'], next_cursor=page['next_cursor'],
+                               total_knowledge=page['total'], page_size=KNOWLEDGE_PAGE_SIZE,
+                               page_fields=','.join(KNOWLEDGE_PAGE_FIELDS))
     except Exception as e:
-        return render_template('knowledge.html', knowledge_list=[])
+        return render_template('knowledge.html', knowledge_list=[], next_cursor=None, total_knowledge=0,
+                               page_size=KNOWLEDGE_PAGE_SIZE, page_fields=','.join(KNOWLEDGE_PAGE_FIELDS))
 
 @admin_bp.route('/testing')
 @login_required
@@ -153,7 +162,56 @@ def get_global_analytics():
         stats = analytics_service.get_global_stats()
         return jsonify({
             'success': True,
-            'data': stats
+            'data': stats,
+            # Queue of the worker that answered; each worker has its own
+            'pipeline': analytics_service.pipeline.status()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@admin_bp.route('/api/analytics/search-cache', methods=['GET'])
+@login_required
+def get_search_cache_stats():
+    """Get knowledge search cache hit/miss counters (per worker)"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': knowledge_service.get_search_cache_stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@admin_bp.route('/api/database/status', methods=['GET'])
+@login_required
+def get_database_status():
+    """Get this worker's database backend and health probe"""
+    try:
+        from app.config.firebase_config import database
+        return jsonify({
+            'success': True,
+            'data': database.health()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@admin_bp.route('/api/replica/status', methods=['GET'])
+@login_required
+def get_replica_status():
+    """Get freshness of this worker's in-memory database mirrors"""
+    try:
+        from app.config.replica import live_replica
+        return jsonify({
+            'success': True,
+            'data': live_replica.status()
         })
     except Exception as e:
         return jsonify({
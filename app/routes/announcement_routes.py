@@ -1,8 +1,10 @@
 
 from flask import Blueprint, request, jsonify
 from app.services.announcement_service import announcement_service
+from app.services.change_log import parse_since, sync_token
 from app.middleware.auth import login_required
 from app.middleware.analytics import track_api_request
+from app.middleware.etag import conditional_get
 
 announcement_bp = Blueprint('announcement', __name__)
 
@@ -10,13 +12,30 @@ ALLOWED_CATEGORIES = ['Penting', 'Akademik', 'Umum', 'Info', 'Peraturan']
 
 @announcement_bp.route('/', methods=['GET'])
 @track_api_request
+@conditional_get('announcements')
 def get_all_announcements():
-    """Get all announcements"""
+    """Get all announcements, or only changes and deletions with since=<sync_token>"""
     try:
+        since = request.args.get('since')
+        if since:
+            try:
+                changes = announcement_service.get_announcement_changes(parse_since(since))
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            return jsonify({
+                'success': True,
+                **changes
+            })
+        
+        token = sync_token()
         announcements = announcement_service.get_all_announcements()
         return jsonify({
             'success': True,
-            'data': announcements
+            'data': announcements,
+            'sync_token': token
         })
     except Exception as e:
         return jsonify({
@@ -25,6 +44,7 @@ def get_all_announcements():
         }), 500
 
 @announcement_bp.route('/<announcement_id>', methods=['GET'])
+@conditional_get('announcements')
 def get_announcement(announcement_id):
     """Get announcement by ID"""
     try:
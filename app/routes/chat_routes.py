@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
 from app.services.gemini_service import gemini_service
-from app.services.knowledge_service import knowledge_service
+from app.services.knowledge_service import knowledge_service, parse_categories
 from app.middleware.analytics import track_api_request
 
 chat_bp = Blueprint('chat', __name__)
@@ -29,10 +29,14 @@ def process_message():
                 'source': 'filter'
             })
         
+        # Optional category filter, e.g. the app screen the user is on ("akademik")
+        categories = parse_categories(data.get('categories', data.get('category')))
+        
         # Search for relevant knowledge in database
-        knowledge_result = knowledge_service.search_knowledge(user_message)
+        knowledge_result = knowledge_service.search_knowledge(user_message, categories=categories)
         knowledge_context = knowledge_result.get('context', '')
         knowledge_image_url = knowledge_result.get('image_url', '')
+        corrected_query = knowledge_result.get('corrected_query', '')
         
         # Generate response using Gemini
         ai_response = gemini_service.generate_response(user_message, knowledge_context)
@@ -41,6 +45,10 @@ def process_message():
         if knowledge_image_url:
             ai_response['image_url'] = knowledge_image_url
         
+        # Let the app show what the typo correction searched for
+        if corrected_query:
+            ai_response['did_you_mean'] = corrected_query
+        
         return jsonify(ai_response)
         
     except Exception as e:
@@ -61,12 +69,27 @@ def health_check():
         from datetime import timezone, timedelta
         WIB = timezone(timedelta(hours=7))
         
+        # Database backend and freshness of this worker's local mirrors
+        from app.config.firebase_config import database
+        from app.config.replica import live_replica
+        db_health = database.health()
+        mirrors = live_replica.status()['mirrors']
+        
         return jsonify({
             'success': True,
             'status': 'online',
             'service': 'academic-chatbot-api',
             'message': 'API is running successfully',
-            'timestamp': datetime.now(WIB).isoformat()
+            'timestamp': datetime.now(WIB).isoformat(),
+            'database': {
+                'backend': db_health['backend'],
+                'ok': db_health['ok'],
+                'latency_ms': db_health['latency_ms']
+            },
+            'replica': {
+                'mirrors': len(mirrors),
+                'fresh': sum(1 for mirror in mirrors if mirror['fresh'])
+            }
         }), 200
     except Exception as e:
         return jsonify({
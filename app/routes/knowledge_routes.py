@@ -1,21 +1,202 @@
 from flask import Blueprint, request, jsonify
-from app.services.knowledge_service import knowledge_service
+import os
+from app.services.change_log import parse_since, sync_token
+from app.services.knowledge_service import knowledge_service, parse_categories
 from app.services.cloudinary_service import CloudinaryService
 from app.middleware.analytics import track_api_request
+from app.middleware.etag import conditional_get
+from app.middleware.auth import login_required
 
 knowledge_bp = Blueprint('knowledge', __name__)
 cloudinary_service = CloudinaryService()
 
+# Upper bound on queries per batch search request; a batch occupies a worker thread
+BATCH_SEARCH_MAX_QUERIES = int(os.getenv('KNOWLEDGE_BATCH_MAX_QUERIES', '100'))
+
 @knowledge_bp.route('/', methods=['GET'])
 @track_api_request
+@conditional_get('knowledge')
 def get_all_knowledge():
-    """Get all knowledge entries"""
+    """Get knowledge entries
+    
+    Query params (all optional): limit, after (cursor), fields (comma-separated),
+    order_by (id, updated_at, category), order (asc, desc), q (text in the
+    question, answer or keywords) and category (repeatable or comma-separated).
+    Without limit every entry is returned.
+    
+    With since=<sync_token> only entries changed since then are returned,
+    with tombstones for deleted ones under 'deleted'.
+    """
     try:
-        knowledge_list = knowledge_service.get_all_knowledge()
+        since = request.args.get('since')
+        if since:
+            try:
+                changes = knowledge_service.get_knowledge_changes(parse_since(since))
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            return jsonify({
+                'success': True,
+                **changes,
+                'count': len(changes['data'])
+            })
+        
+        token = sync_token()
+        limit = request.args.get('limit')
+        fields = request.args.get('fields')
+        try:
+            if limit and not limit.isdigit():
+                raise ValueError('limit must be a positive integer')
+            page = knowledge_service.list_knowledge(
+                limit=int(limit) if limit else None,
+                after=request.args.get('after') or None,
+                fields=[field.strip() for field in fields.split(',') if field.strip()] if fields else None,
+                order_by=request.args.get('order_by', 'id'),
+                order=request.args.get('order', 'asc'),
+                query=request.args.get('q') or None,
+                categories=parse_categories(request.args.getlist('category') or request.args.get('categories'))
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
         return jsonify({
             'success': True,
-            'data': knowledge_list,
-            'total': len(knowledge_list)
+            'data': page['items'],
+            'count': len(page['items']),
+            'total': page['total'],
+            'next_cursor': page['next_cursor'],
+            'sync_token': token
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@knowledge_bp.route('/search', methods=['GET', 'POST'])
+@track_api_request
+@conditional_get('knowledge')
+def search_knowledge():
+    """Search knowledge entries, optionally limited to one or more categories"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+        else:
+            data = request.args
+        query = (data.get('query') or data.get('q') or '').strip()
+        
+        if not query:
+            return jsonify({
+                'success': False,
+                'error': 'Query is required'
+            }), 400
+        
+        if request.method == 'POST':
+            categories = parse_categories(data.get('categories', data.get('category')))
+        else:
+            categories = parse_categories(request.args.getlist('category') or request.args.get('categories'))
+        
+        try:
+            limit = max(1, min(int(data.get('limit', 3)), 20))
+        except (TypeError, ValueError):
+            limit = 3
+        
+        # The ETag carries knowledge_meta/version, so the results must not come from an older index
+        results = knowledge_service.search_knowledge_batch(
+            [query], mode=data.get('mode'), limit=limit, categories=categories, check_version=True
+        )
+        if not results:
+            return jsonify({'success': False, 'error': 'Failed to search knowledge'}), 500
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'categories': categories or [],
+            'corrected_query': results[0]['corrected_query'],
+            'data': results[0]['matches'],
+            'total': len(results[0]['matches'])
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@knowledge_bp.route('/search/batch', methods=['POST'])
+@track_api_request
+@login_required
+def search_knowledge_batch():
+    """Admin only: rank knowledge for a list of queries (no Gemini calls)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        
+        if not isinstance(queries, list) or not queries:
+            return jsonify({
+                'success': False,
+                'error': 'queries must be a non-empty list'
+            }), 400
+        
+        if len(queries) > BATCH_SEARCH_MAX_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {BATCH_SEARCH_MAX_QUERIES} queries per request'
+            }), 400
+        
+        if not all(isinstance(query, str) for query in queries):
+            return jsonify({
+                'success': False,
+                'error': 'Every query must be a string'
+            }), 400
+        
+        try:
+            limit = max(1, min(int(data.get('limit', 3)), 20))
+        except (TypeError, ValueError):
+            limit = 3
+        
+        categories = parse_categories(data.get('categories', data.get('category')))
+        results = knowledge_service.search_knowledge_batch(queries, mode=data.get('mode'), limit=limit, categories=categories)
+        if not results:
+            return jsonify({'success': False, 'error': 'Failed to search knowledge'}), 500
+        
+        return jsonify({
+            'success': True,
+            'data': results,
+            'total': len(results)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@knowledge_bp.route('/search/explain', methods=['GET'])
+@login_required
+def explain_knowledge_search():
+    """Admin only: explain how a query is normalized, scored and ranked, with per-stage timings"""
+    try:
+        query = (request.args.get('q') or request.args.get('query') or '').strip()
+        if not query:
+            return jsonify({
+                'success': False,
+                'error': 'Query is required'
+            }), 400
+        
+        try:
+            limit = max(1, min(int(request.args.get('limit', 3)), 20))
+        except (TypeError, ValueError):
+            limit = 3
+        
+        categories = parse_categories(request.args.getlist('category') or request.args.get('categories'))
+        explanation = knowledge_service.explain_search(query, mode=request.args.get('mode'), categories=categories, limit=limit)
+        return jsonify({
+            'success': True,
+            'data': explanation
         })
     except Exception as e:
         return jsonify({
@@ -24,6 +205,7 @@ def get_all_knowledge():
         }), 500
 
 @knowledge_bp.route('/<knowledge_id>', methods=['GET'])
+@conditional_get('knowledge')
 def get_knowledge(knowledge_id):
     """Get single knowledge entry"""
     try:
@@ -223,6 +405,7 @@ def delete_knowledge(knowledge_id):
         }), 500
 
 @knowledge_bp.route('/stats', methods=['GET'])
+@conditional_get('knowledge')
 def get_knowledge_stats():
     """Get knowledge statistics"""
     try:
@@ -235,4 +418,66 @@ def get_knowledge_stats():
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@knowledge_bp.route('/stats/rebuild', methods=['POST'])
+@login_required
+def rebuild_knowledge_stats():
+    """Recount the knowledge statistics counters from the full knowledge tree"""
+    try:
+        stats = knowledge_service.rebuild_knowledge_stats()
+        return jsonify({
+            'success': True,
+            'message': 'Knowledge stats rebuilt',
+            'data': stats
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@knowledge_bp.route('/vocabulary', methods=['GET'])
+@login_required
+def get_search_vocabulary():
+    """Get the synonym and stop word tables used by knowledge search"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': knowledge_service.get_search_vocabulary()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@knowledge_bp.route('/vocabulary', methods=['PUT'])
+@login_required
+def update_search_vocabulary():
+    """Replace the synonym and stop word tables and recompile the search index"""
+    try:
+        data = request.get_json(silent=True) or {}
+        synonyms = data.get('synonyms', {})
+        stop_words = data.get('stop_words', [])
+        
+        if not isinstance(synonyms, dict) or not isinstance(stop_words, list):
+            return jsonify({
+                'success': False,
+                'error': 'synonyms must be an object and stop_words a list'
+            }), 400
+        
+        if knowledge_service.update_search_vocabulary(synonyms, stop_words):
+            return jsonify({
+                'success': True,
+                'message': 'Search vocabulary updated successfully',
+                'data': knowledge_service.get_search_vocabulary()
+            })
+        else:
+            return jsonify({'success': False, 'error': 'Failed to update search vocabulary'}), 500
+            
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
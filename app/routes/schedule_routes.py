@@ -1,19 +1,43 @@
 from flask import Blueprint, request, jsonify
-from app.services.schedule_service import schedule_service
+from datetime import datetime
+from app.services.schedule_service import schedule_service, WIB
+from app.services.change_log import parse_since, sync_token
 from app.middleware.auth import login_required
 from app.middleware.analytics import track_api_request
+from app.middleware.etag import conditional_get
 
 schedule_bp = Blueprint('schedule', __name__)
 
+def _today():
+    """Upcoming/past counts in the stats change at midnight WIB, not only on writes"""
+    return datetime.now(WIB).date().isoformat()
+
 @schedule_bp.route('/', methods=['GET'])
 @track_api_request
+@conditional_get('schedules')
 def get_all_schedules():
-    """Get all schedule events (for mobile app)"""
+    """Get all schedule events (for mobile app), or only changes and deletions with since=<sync_token>"""
     try:
+        since = request.args.get('since')
+        if since:
+            try:
+                changes = schedule_service.get_schedule_changes(parse_since(since))
+            except ValueError as e:
+                return jsonify({
+                    'sukses': False,
+                    'error': str(e)
+                }), 400
+            return jsonify({
+                'sukses': True,
+                **changes
+            })
+
+        token = sync_token()
         schedules = schedule_service.get_all_schedules()
         return jsonify({
             'sukses': True,
-            'data': schedules
+            'data': schedules,
+            'sync_token': token
         })
     except Exception as e:
         return jsonify({
@@ -23,6 +47,7 @@ def get_all_schedules():
 
 @schedule_bp.route('/range', methods=['GET'])
 @track_api_request
+@conditional_get('schedules')
 def get_schedules_by_range():
     """Get schedules by date range (for mobile calendar view)"""
     try:
@@ -42,6 +67,7 @@ def get_schedules_by_range():
 
 @schedule_bp.route('/<schedule_id>', methods=['GET'])
 @track_api_request
+@conditional_get('schedules')
 def get_schedule(schedule_id):
     """Get schedule by ID"""
     try:
@@ -185,6 +211,7 @@ def delete_schedule(schedule_id):
 
 @schedule_bp.route('/stats', methods=['GET'])
 @track_api_request
+@conditional_get('schedules', vary=_today)
 def get_schedule_stats():
     """Get schedule statistics"""
     try:
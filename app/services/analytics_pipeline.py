@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Flush when this many events are queued, or after this many seconds
+ANALYTICS_FLUSH_EVENTS = max(1, int(os.getenv('ANALYTICS_FLUSH_EVENTS', '100')))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv('ANALYTICS_FLUSH_SECONDS', '5'))
+
+# Events held per worker while the database is slow; beyond this they are dropped
+ANALYTICS_QUEUE_SIZE = max(1, int(os.getenv('ANALYTICS_QUEUE_SIZE', '10000')))
+
+
+class AnalyticsPipeline:
+    """Per-worker queue of analytics events written in batches by a background thread
+
+    submit() never blocks on the database: it only enqueues. The flusher
+    thread hands everything queued to `writer` once `flush_events` are waiting
+    or every `flush_seconds`, and a last flush runs at interpreter exit. A
+    batch that can't be written is split in halves and retried, so one bad
+    event doesn't take the rest of the batch with it; the retries per flush
+    are bounded, so a database outage isn't hammered. When the queue is full,
+    or events still can't be written, they are dropped and counted rather
+    than slowing requests down.
+    """
+
+    def __init__(self, writer: Callable[[List[Dict]], None], flush_events: int = ANALYTICS_FLUSH_EVENTS,
+                 flush_seconds: float = ANALYTICS_FLUSH_SECONDS, max_queue: int = ANALYTICS_QUEUE_SIZE):
+        self.writer = writer
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        # Serializes flushes between the flusher thread and explicit flush() calls
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._queue: Optional[queue.Queue] = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds: Optional[float] = None
+        self._dropped_reported = 0
+        self._writes_left = 0
+
+    def _ensure_started(self) -> queue.Queue:
+        if self._pid == os.getpid() and self._queue is not None:
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid() or self._queue is None:
+                # First use in this process (or a fork): the parent's thread doesn't exist here
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._wake = threading.Event()
+                self._stopped = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='analytics-flusher', daemon=True)
+                self.submitted = self.written = self.dropped = self.failed_flushes = self._dropped_reported = 0
+                self._pid = os.getpid()
+                self._thread.start()
+            return self._queue
+
+    def submit(self, event: Dict):
+        """Queue an event for the next batch; drops it if the queue is full"""
+        events = self._ensure_started()
+        try:
+            events.put_nowait(event)
+            self.submitted += 1
+        except queue.Full:
+            self.dropped += 1
+            return
+        if events.qsize() >= self.flush_events:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write everything queued now; returns the number of events written"""
+        if self._queue is None or self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if self.dropped > self._dropped_reported:
+                print(f"⚠️ Analytics queue full: dropped {self.dropped - self._dropped_reported} events "
+                      f"({self.dropped} total)")
+                self._dropped_reported = self.dropped
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            # Enough writes to bisect down to a single bad event
+            self._writes_left = 2 * len(batch).bit_length() + 1
+            written = self._write(batch)
+            self.written += written
+            self.last_flush_seconds = time.perf_counter() - started
+            return written
+
+    def _write(self, batch: List[Dict]) -> int:
+        """Write batch, retrying each half when it fails; returns the number of events written"""
+        if self._writes_left <= 0:
+            self._drop(batch, 'no retries left in this flush')
+            return 0
+        self._writes_left -= 1
+        try:
+            self.writer(batch)
+            return len(batch)
+        except Exception as e:
+            self.failed_flushes += 1
+            if len(batch) == 1:
+                self._drop(batch, e)
+                return 0
+            print(f"⚠️ Failed to write {len(batch)} analytics events, retrying in halves: {e}")
+        middle = len(batch) // 2
+        return self._write(batch[:middle]) + self._write(batch[middle:])
+
+    def _drop(self, batch: List[Dict], reason):
+        self.dropped += len(batch)
+        self._dropped_reported = self.dropped
+        print(f"❌ Failed to write {len(batch)} analytics events, dropped: {reason}")
+
+    def close(self):
+        """Stop the flusher and write what is still queued"""
+        if self._pid != os.getpid():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self.flush()
+
+    def status(self) -> Dict:
+        running = self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+        return {
+            'running': running,
+            'queued': self._queue.qsize() if running else 0,
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_flushes': self.failed_flushes,
+            'flush_events': self.flush_events,
+            'flush_seconds': self.flush_seconds,
+            'last_flush_seconds': None if self.last_flush_seconds is None else round(self.last_flush_seconds, 3)
+        }
@@ -1,93 +1,192 @@
 from datetime import datetime, timedelta, timezone
 from app.config.firebase_config import get_db
+from app.config.db_tree import generate_push_id, increment
+from app.services.analytics_pipeline import AnalyticsPipeline
+from app.services.latency_histogram import LatencyHistogram
 from collections import defaultdict
-import uuid
+import atexit
+import os
+import re
+import threading
 
 # WIB Timezone (GMT+7)
 WIB = timezone(timedelta(hours=7))
 
-class AnalyticsService:
-    def __init__(self):
-        self.db = get_db()
+# Characters Firebase rejects in keys; one bad key fails the whole multi-location update
+ENDPOINT_KEY_FORBIDDEN = re.compile(r'[.$#\[\]/\x00-\x1f\x7f]')
+# Well below Firebase's 768-byte key limit, even for multi-byte characters
+ENDPOINT_KEY_MAX_LENGTH = 200
 
-    def log_request(self, endpoint: str, method: str, status_code: int, response_time: float, ip_address: str = '', user_agent: str = ''):
-        """Log API request for analytics"""
-        try:
-            timestamp = datetime.now(WIB)
-            date_key = timestamp.strftime('%Y-%m-%d')
-            time_key = timestamp.strftime('%H:%M:%S')
+# Request logs kept under analytics/realtime; older ones are trimmed
+REALTIME_LOG_CAPACITY = max(1, int(os.getenv('ANALYTICS_REALTIME_CAPACITY', '200')))
 
-            # Structure: analytics/daily/{date}/{endpoint_method}/
-            analytics_ref = self.db.child('analytics').child('daily').child(date_key)
-            endpoint_key = f"{method}_{endpoint.replace('/', '_')}"
+# Each worker trims after this many of its own writes, so the trim query is
+# paid once per batch rather than on every request
+REALTIME_TRIM_EVERY = max(1, int(os.getenv('ANALYTICS_REALTIME_TRIM_EVERY', str(max(1, REALTIME_LOG_CAPACITY // 4)))))
 
-            # Get existing data for this endpoint today
-            endpoint_data = analytics_ref.child(endpoint_key).get() or {}
+class RealtimeLogRing:
+    """Fixed-capacity log of recent requests under analytics/realtime
 
-            # Update counters
-            count = endpoint_data.get('count', 0) + 1
-            total_time = endpoint_data.get('total_response_time', 0) + response_time
-            avg_time = total_time / count
+    Entries are keyed by push id and trimmed by their indexed `timestamp`,
+    the same order get_realtime_logs reads them in. Trimming is amortized:
+    the node holds at most `capacity` plus the writes each worker made since
+    its last trim.
+    """
 
-            # Track errors
-            errors = endpoint_data.get('errors', 0)
-            if status_code >= 400:
-                errors += 1
+    def __init__(self, capacity: int = REALTIME_LOG_CAPACITY, trim_every: int = REALTIME_TRIM_EVERY):
+        self.capacity = capacity
+        self.trim_every = trim_every
+        self._since_trim = 0
+        self._lock = threading.Lock()
 
-            # Update endpoint analytics
-            analytics_ref.child(endpoint_key).update({
-                'endpoint': endpoint,
-                'method': method,
-                'count': count,
-                'total_response_time': total_time,
-                'avg_response_time': round(avg_time, 3),
-                'errors': errors,
-                'last_request': timestamp.isoformat(),
-                'status_codes': {
-                    str(status_code): endpoint_data.get('status_codes', {}).get(str(status_code), 0) + 1
-                }
-            })
+    @staticmethod
+    def _ref(db_ref):
+        return db_ref.child('analytics').child('realtime')
+
+    def stage(self, updates: dict, entry: dict) -> str:
+        """Add entry as the newest log to `updates`, a multi-location update on analytics/"""
+        key = generate_push_id()
+        updates[f'realtime/{key}'] = {**entry, 'id': key}
+        return key
+
+    def appended(self, db_ref, count: int):
+        """Record logs this worker wrote and trim when its batch is full"""
+        with self._lock:
+            self._since_trim += count
+            due = self._since_trim >= self.trim_every
+            if due:
+                self._since_trim = 0
+        if due:
+            self.trim(db_ref)
+
+    def trim(self, db_ref) -> int:
+        """Delete everything older than the newest `capacity` logs; returns how many were deleted
 
-            # Log individual request in realtime (keep last 100)
-            request_log = {
-                'id': str(uuid.uuid4())[:8],
+        Ordered by timestamp rather than key: logs written before the ring
+        used push ids have 8-character keys, which sort among or after the
+        newest push ids.
+        """
+        try:
+            ref = self._ref(db_ref)
+            newest = ref.order_by_child('timestamp').limit_to_last(self.capacity).get() or {}
+            if len(newest) < self.capacity:
+                return 0
+            cutoff = min((str(log.get('timestamp') or '') for log in newest.values() if isinstance(log, dict)), default='')
+            # Bounded, so a long untrimmed backlog is worked off over several trims
+            older = ref.order_by_child('timestamp').end_at(cutoff).limit_to_first(self.capacity).get() or {}
+            stale = [key for key in older if key not in newest]
+            if stale:
+                ref.update({key: None for key in stale})
+            return len(stale)
+        except Exception as e:
+            print(f"⚠️ Failed to trim realtime logs: {e}")
+            return 0
+
+class AnalyticsService:
+    def __init__(self):
+        self.realtime_logs = RealtimeLogRing()
+        self.pipeline = AnalyticsPipeline(self._write_events)
+
+    @property
+    def db(self):
+        """Resolved per call: capturing it at import would pin whatever backend
+        existed before Firebase was initialized (the mock) for the process lifetime"""
+        return get_db()
+
+    def log_request(self, endpoint: str, method: str, status_code: int, response_time: float, ip_address: str = '', user_agent: str = ''):
+        """Queue an API request for analytics; written in the next batch, off the request thread"""
+        try:
+            self.pipeline.submit({
                 'endpoint': endpoint,
                 'method': method,
                 'status_code': status_code,
-                'response_time': round(response_time, 3),
-                'timestamp': timestamp.isoformat(),
+                'response_time': response_time,
+                'timestamp': datetime.now(WIB),
                 'ip': ip_address[:15],  # Truncate for privacy
                 'user_agent': user_agent[:100]  # Truncate long user agents
-            }
-
-            # Store in realtime logs (limited to last 100)
-            realtime_ref = self.db.child('analytics').child('realtime')
-            realtime_ref.child(request_log['id']).set(request_log)
-
-            # Update global stats
-            self._update_global_stats(endpoint, method, status_code)
-
+            })
         except Exception as e:
             print(f"❌ Failed to log analytics: {e}")
 
-    def _update_global_stats(self, endpoint, method, status_code):
-        """Update global statistics"""
-        try:
-            stats_ref = self.db.child('analytics').child('stats')
-            stats = stats_ref.get() or {}
+    def flush(self) -> int:
+        """Write queued analytics now (e.g. before reading them back)"""
+        return self.pipeline.flush()
+
+    def _write_events(self, events):
+        """Write a batch of requests as one multi-location update under analytics/
 
-            total_requests = stats.get('total_requests', 0) + 1
-            total_errors = stats.get('total_errors', 0)
-            if status_code >= 400:
+        Counters and latency histograms are summed per endpoint and day in
+        memory, then added with server-side increments: no reads, and
+        concurrent workers can't lose each other's counts.
+        """
+        analytics_ref = self.db.child('analytics')
+
+        # Structure: analytics/daily/{date}/{endpoint_method}/
+        endpoints = {}
+        total_errors = 0
+        for event in events:
+            timestamp = event['timestamp']
+            endpoint_key = self._endpoint_key(event['method'], event['endpoint'])
+            totals = endpoints.setdefault((timestamp.strftime('%Y-%m-%d'), endpoint_key), {
+                'endpoint': event['endpoint'],
+                'method': event['method'],
+                'count': 0,
+                'total_response_time': 0,
+                'errors': 0,
+                'status_codes': defaultdict(int),
+                'latency': LatencyHistogram()
+            })
+            totals['count'] += 1
+            totals['total_response_time'] += event['response_time']
+            totals['latency'].record(event['response_time'] * 1000)
+            totals['status_codes'][str(event['status_code'])] += 1
+            totals['last_request'] = timestamp.isoformat()
+            if event['status_code'] >= 400:
+                totals['errors'] += 1
                 total_errors += 1
 
-            stats_ref.update({
-                'total_requests': total_requests,
-                'total_errors': total_errors,
-                'last_updated': datetime.now(WIB).isoformat()
+        updates = {}
+        for (date, endpoint_key), totals in endpoints.items():
+            base = f'daily/{date}/{endpoint_key}'
+            updates[f'{base}/endpoint'] = totals['endpoint']
+            updates[f'{base}/method'] = totals['method']
+            updates[f'{base}/count'] = increment(totals['count'])
+            updates[f'{base}/total_response_time'] = increment(totals['total_response_time'])
+            updates[f'{base}/last_request'] = totals['last_request']
+            if totals['errors']:
+                updates[f'{base}/errors'] = increment(totals['errors'])
+            for code, code_count in totals['status_codes'].items():
+                updates[f'{base}/status_codes/{code}'] = increment(code_count)
+            # Histograms merge by adding bucket counts
+            for bucket, bucket_count in totals['latency'].to_dict().items():
+                updates[f'{base}/latency_ms/{bucket}'] = increment(bucket_count)
+
+        # Update global stats
+        updates['stats/total_requests'] = increment(len(events))
+        if total_errors:
+            updates['stats/total_errors'] = increment(total_errors)
+        updates['stats/last_updated'] = datetime.now(WIB).isoformat()
+
+        # Individual requests go to the realtime ring buffer; older ones would be trimmed anyway
+        logged = events[-self.realtime_logs.capacity:]
+        for event in logged:
+            self.realtime_logs.stage(updates, {
+                'endpoint': event['endpoint'],
+                'method': event['method'],
+                'status_code': event['status_code'],
+                'response_time': round(event['response_time'], 3),
+                'timestamp': event['timestamp'].isoformat(),
+                'ip': event['ip'],
+                'user_agent': event['user_agent']
             })
-        except Exception as e:
-            print(f"⚠️ Failed to update global stats: {e}")
+
+        analytics_ref.update(updates)
+        self.realtime_logs.appended(self.db, len(logged))
+
+    @staticmethod
+    def _endpoint_key(method: str, endpoint: str) -> str:
+        """Key of an endpoint's daily totals, e.g. GET__api_knowledge_search"""
+        return ENDPOINT_KEY_FORBIDDEN.sub('_', f"{method}_{endpoint}")[:ENDPOINT_KEY_MAX_LENGTH]
 
     def get_daily_stats(self, date=None):
         """Get analytics for a specific date"""
@@ -100,27 +199,40 @@ class AnalyticsService:
 
             # Convert to list format
             endpoints = []
+            day_latency = LatencyHistogram()
             for key, value in data.items():
                 if isinstance(value, dict):
-                    endpoints.append(value)
+                    endpoint = {name: item for name, item in value.items() if name != 'latency_ms'}
+                    endpoint.setdefault('errors', 0)
+                    # Derived here: with increments the stored totals never pass through this process
+                    endpoint['avg_response_time'] = round(endpoint.get('total_response_time', 0) / max(endpoint.get('count', 0), 1), 3)
+                    latency = LatencyHistogram.from_dict(value.get('latency_ms'))
+                    endpoint.update(latency.summary())
+                    day_latency.merge(latency)
+                    endpoints.append(endpoint)
 
             return {
                 'date': date,
                 'endpoints': sorted(endpoints, key=lambda x: x.get('count', 0), reverse=True),
                 'total_requests': sum(e.get('count', 0) for e in endpoints),
-                'total_errors': sum(e.get('errors', 0) for e in endpoints)
+                'total_errors': sum(e.get('errors', 0) for e in endpoints),
+                'latency': day_latency.summary()
             }
         except Exception as e:
             print(f"❌ Failed to get daily stats: {e}")
-            return {'date': date, 'endpoints': [], 'total_requests': 0, 'total_errors': 0}
+            return {'date': date, 'endpoints': [], 'total_requests': 0, 'total_errors': 0,
+                    'latency': LatencyHistogram().summary()}
 
     def get_realtime_logs(self, limit=100):
-        """Get recent API requests"""
+        """Get recent API requests, newest first
+
+        Only the last `limit` logs by timestamp are downloaded (indexed,
+        see database.rules.json).
+        """
         try:
             realtime_ref = self.db.child('analytics').child('realtime')
-            logs = realtime_ref.get() or {}
+            logs = realtime_ref.order_by_child('timestamp').limit_to_last(limit).get() or {}
 
-            # Convert to list and sort by timestamp
             log_list = [v for v in logs.values() if isinstance(v, dict)]
             log_list.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
 
@@ -174,4 +286,7 @@ class AnalyticsService:
             return 0
 
 # Global instance
-analytics_service = AnalyticsService()
\ No newline at end of file
+analytics_service = AnalyticsService()
+
+# Write what is still queued when a worker exits
+atexit.register(analytics_service.pipeline.close)
\ No newline at end of file
@@ -2,19 +2,16 @@
 from datetime import datetime, timezone, timedelta
 import uuid
 from app.config.firebase_config import get_db
+from app.services.change_log import collect_changes, record_deletion, sync_token
+from app.services.collection_version import bump_collection_version
 
 # WIB Timezone (GMT+7)
 WIB = timezone(timedelta(hours=7))
 
 class AnnouncementService:
-    def __init__(self):
-        self.db_ref = None
-    
     def get_db_ref(self):
-        """Get database reference"""
-        if self.db_ref is None:
-            self.db_ref = get_db()
-        return self.db_ref
+        """Get database reference (cheap: the handle is resolved once per worker)"""
+        return get_db()
     
     def get_all_announcements(self):
         """Get all announcements"""
@@ -45,6 +42,12 @@ class AnnouncementService:
             print(f"❌ Error getting announcements: {e}")
             return []
     
+    def get_announcement_changes(self, since: datetime) -> dict:
+        """Announcements created or updated since a previous sync, plus tombstones of deleted ones"""
+        token = sync_token()
+        return collect_changes(self.get_db_ref(), 'announcements', self.get_all_announcements(), since,
+                               ('updated_at', 'created_at'), token)
+    
     def get_announcement_by_id(self, announcement_id: str):
         """Get announcement by ID"""
         try:
@@ -86,6 +89,7 @@ class AnnouncementService:
             }
             
             announcements_ref.child(announcement_id).set(announcement_data)
+            bump_collection_version(db_ref, 'announcements')
             print(f"✅ Announcement created successfully with ID: {announcement_id}")
             
             return {
@@ -120,6 +124,7 @@ class AnnouncementService:
             }
             
             announcement_ref.update(update_data)
+            bump_collection_version(db_ref, 'announcements')
             print(f"✅ Announcement {announcement_id} updated successfully")
             return True
             
@@ -139,6 +144,8 @@ class AnnouncementService:
                 return False
             
             announcement_ref.delete()
+            record_deletion(db_ref, 'announcements', announcement_id)
+            bump_collection_version(db_ref, 'announcements')
             print(f"✅ Announcement {announcement_id} deleted successfully")
             return True
             
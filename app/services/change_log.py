@@ -0,0 +1,124 @@
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# WIB Timezone (GMT+7)
+WIB = timezone(timedelta(hours=7))
+
+# Tombstones older than this are pruned; clients syncing from before it get a full list
+TOMBSTONE_RETENTION_DAYS = int(os.getenv('SYNC_TOMBSTONE_RETENTION_DAYS', '30'))
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Parse a stored or client-supplied timestamp into an aware datetime
+
+    Accepts ISO 8601 strings (with 'T' or a space, with or without offset),
+    'Z' suffixes and epoch seconds or milliseconds. Naive values are WIB,
+    matching how the services write them. Returns None when unparseable.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        text = str(value).strip()
+        try:
+            epoch = float(text)
+        except ValueError:
+            epoch = None
+        if epoch is not None:
+            if epoch > 1e11:  # milliseconds
+                epoch /= 1000
+            return datetime.fromtimestamp(epoch, WIB)
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=WIB)
+    return parsed
+
+
+def parse_since(value: str) -> datetime:
+    """Parse the `since` query parameter, raising ValueError when it is not a timestamp"""
+    since = parse_timestamp(value)
+    if since is None:
+        raise ValueError('since must be an ISO 8601 timestamp or epoch seconds (use sync_token from the previous response)')
+    return since
+
+
+def sync_token() -> str:
+    """Token a client sends back as `since` on its next sync
+
+    Taken before the data is read, and changes are matched inclusively,
+    so a write racing the read is sent again rather than missed.
+    """
+    return datetime.now(WIB).isoformat()
+
+
+def record_deletion(db_ref, collection: str, record_id: str):
+    """Write a tombstone for a deleted record and prune expired ones"""
+    try:
+        tombstones_ref = db_ref.child('deletions').child(collection)
+        tombstones_ref.child(record_id).set({'deleted_at': datetime.now(WIB).isoformat()})
+
+        cutoff = datetime.now(WIB) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        tombstones = tombstones_ref.get() or {}
+        for tombstone_id, tombstone in tombstones.items():
+            deleted_at = parse_timestamp(tombstone.get('deleted_at') if isinstance(tombstone, dict) else None)
+            if deleted_at is None or deleted_at < cutoff:
+                tombstones_ref.child(tombstone_id).delete()
+    except Exception as e:
+        print(f"⚠️ Could not record deletion of {collection}/{record_id}: {e}")
+
+
+def get_deletions(db_ref, collection: str, since: datetime) -> List[Dict]:
+    """Tombstones for a collection written at or after `since`"""
+    try:
+        tombstones = db_ref.child('deletions').child(collection).get() or {}
+    except Exception as e:
+        print(f"⚠️ Could not read deletions for {collection}: {e}")
+        return []
+
+    deleted = []
+    for record_id, tombstone in tombstones.items():
+        deleted_at = parse_timestamp(tombstone.get('deleted_at') if isinstance(tombstone, dict) else None)
+        if deleted_at is not None and deleted_at >= since:
+            deleted.append({'id': record_id, 'deleted_at': tombstone['deleted_at']})
+    deleted.sort(key=lambda item: item['deleted_at'])
+    return deleted
+
+
+def collect_changes(db_ref, collection: str, records: Iterable[Dict], since: datetime,
+                    timestamp_fields: Tuple[str, ...], token: str) -> Dict:
+    """Delta of a collection since a previous sync
+
+    Records whose first present timestamp field is at or after `since` are
+    returned with the tombstones written since then. When `since` is older
+    than the tombstone retention, deletions may have been pruned, so every
+    record is returned with reset=True and the client replaces its copy.
+    Records with no timestamp predate change tracking and are never resent.
+
+    Returns {'data', 'deleted', 'sync_token', 'reset'}.
+    """
+    if since < datetime.now(WIB) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        return {'data': list(records), 'deleted': [], 'sync_token': token, 'reset': True}
+
+    # Schedules store whole seconds, so compare at that precision: a write in the
+    # same second as the token is sent again instead of being missed
+    since = since.replace(microsecond=0)
+    changed = []
+    for record in records:
+        stamp = next((record[field] for field in timestamp_fields if record.get(field)), None)
+        changed_at = parse_timestamp(stamp)
+        if changed_at is not None and changed_at >= since:
+            changed.append(record)
+
+    return {
+        'data': changed,
+        'deleted': get_deletions(db_ref, collection, since),
+        'sync_token': token,
+        'reset': False
+    }
@@ -0,0 +1,40 @@
+import uuid
+from typing import Optional
+
+# Collections whose writes bump `<collection>_meta/version`
+# ('knowledge' shares the node the search index already syncs on)
+VERSIONED_COLLECTIONS = ('knowledge', 'announcements', 'schedules')
+
+
+def _version_ref(db_ref, collection: str):
+    return db_ref.child(f'{collection}_meta').child('version')
+
+
+def get_collection_version(db_ref, collection: str) -> Optional[str]:
+    """Current version token of a collection, created on first use
+
+    Returns None when the database can't be read.
+    """
+    try:
+        version = _version_ref(db_ref, collection).get()
+        if not version:
+            version = bump_collection_version(db_ref, collection)
+        return version
+    except Exception as e:
+        print(f"⚠️ Could not read {collection} version: {e}")
+        return None
+
+
+def bump_collection_version(db_ref, collection: str) -> Optional[str]:
+    """Give a collection a new version token after a write
+
+    A random token rather than an incrementing number, so two writers racing
+    without a transaction can never leave different data under the same version.
+    """
+    try:
+        version = uuid.uuid4().hex
+        _version_ref(db_ref, collection).set(version)
+        return version
+    except Exception as e:
+        print(f"⚠️ Could not bump {collection} version: {e}")
+        return None
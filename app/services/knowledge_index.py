@@ -0,0 +1,528 @@
+import heapq
+import math
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Container, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from app.services.spell_correction import SymSpellDictionary
+
+# Searchable fields of a knowledge entry, in posting tuple order
+FIELDS = ('question', 'answer', 'keywords', 'category')
+
+# BM25F parameters; field weights follow FIELDS order
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25F_FIELD_WEIGHTS = (3.0, 1.0, 2.0, 0.5)
+# Query weight of fuzzy variants and the share of the best score a match must reach
+BM25_FUZZY_WEIGHT = 0.5
+BM25_RELATIVE_CUTOFF = 0.3
+
+# Fuzzy matching: minimum trigram Dice overlap and how many candidates get verified
+FUZZY_TRIGRAM_THRESHOLD = 0.4
+FUZZY_MAX_CANDIDATES = 20
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into word tokens"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(str(text).lower())
+
+
+def trigrams(word: str) -> Set[str]:
+    """Character trigrams of a word, padded so prefixes and suffixes count"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def normalize_category(category) -> str:
+    """Lowercased, interned category name used as the partition key"""
+    return sys.intern(str(category or 'general').strip().lower())
+
+
+def character_similarity(word1: str, word2: str) -> float:
+    """Calculate similarity between two words using simple character overlap"""
+    if not word1 or not word2:
+        return 0.0
+
+    set1 = set(word1.lower())
+    set2 = set(word2.lower())
+
+    intersection = len(set1.intersection(set2))
+    union = len(set1.union(set2))
+
+    return intersection / union if union > 0 else 0.0
+
+
+class SearchVocabulary:
+    """Synonym and stop word tables, compiled for use at indexing time
+
+    synonyms maps a head word to the words and phrases that mean the same.
+    Documents containing a synonym get a posting under its head as well, so a
+    query for the head finds them without any query-time expansion. Stop words
+    are dropped when documents and queries are tokenized.
+    """
+
+    def __init__(self, synonyms: Optional[Dict[str, Iterable[str]]] = None, stop_words: Iterable[str] = ()):
+        self.stop_words: FrozenSet[str] = frozenset(
+            word for word in (str(word).strip().lower() for word in stop_words) if word
+        )
+        self.synonyms: Dict[str, Tuple[str, ...]] = {}
+        # synonym token / token tuple -> the heads it stands for
+        self._heads_by_term: Dict[str, Tuple[str, ...]] = {}
+        self._heads_by_phrase: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._phrases_by_first: Dict[str, Set[Tuple[str, ...]]] = {}
+
+        for head, values in (synonyms or {}).items():
+            head_terms = tokenize(head)
+            if len(head_terms) != 1:
+                continue
+            head = sys.intern(head_terms[0])
+            if isinstance(values, str):
+                values = values.split(',')
+            values = tuple(dict.fromkeys(
+                ' '.join(tokenize(value)) for value in values or () if tokenize(value)
+            ))
+            self.synonyms[head] = values
+            if head in self.stop_words:
+                continue
+            for value in values:
+                phrase = tuple(value.split())
+                if phrase == (head,):
+                    continue
+                if len(phrase) == 1:
+                    self._heads_by_term[phrase[0]] = self._heads_by_term.get(phrase[0], ()) + (head,)
+                else:
+                    self._heads_by_phrase[phrase] = self._heads_by_phrase.get(phrase, ()) + (head,)
+                    self._phrases_by_first.setdefault(phrase[0], set()).add(phrase)
+
+        self.heads: FrozenSet[str] = frozenset(
+            head for heads in list(self._heads_by_term.values()) + list(self._heads_by_phrase.values()) for head in heads
+        )
+        # Words the typo corrector must never rewrite
+        self.protected: FrozenSet[str] = self.stop_words | frozenset(self.synonyms) | frozenset(
+            term for values in self.synonyms.values() for value in values for term in value.split()
+        )
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SearchVocabulary) and \
+            (self.synonyms, self.stop_words) == (other.synonyms, other.stop_words)
+
+    def to_dict(self) -> Dict:
+        return {
+            'synonyms': {head: list(values) for head, values in self.synonyms.items()},
+            'stop_words': sorted(self.stop_words)
+        }
+
+    def synonym_heads(self, tokens: List[str]) -> List[str]:
+        """Heads of every synonym occurrence in a token sequence"""
+        heads = []
+        for position, token in enumerate(tokens):
+            heads.extend(self._heads_by_term.get(token, ()))
+            for phrase in self._phrases_by_first.get(token, ()):
+                if tuple(tokens[position:position + len(phrase)]) == phrase:
+                    heads.extend(self._heads_by_phrase[phrase])
+        return heads
+
+
+class IndexedDoc:
+    """Precomputed, normalized form of one knowledge entry
+
+    Terms and the category are interned, so every document shares the same
+    string objects as the posting keys instead of holding its own copies.
+    field_counts[i] is the posting tuple of terms[i] (the same object). A doc
+    is replaced, never changed, so a list of docs is a consistent snapshot.
+    """
+
+    __slots__ = ('entry', 'text', 'terms', 'field_counts', 'lengths', 'norms', 'category', 'updated_at')
+
+    def __init__(self, entry: Dict, text: str, terms: Tuple[str, ...], field_counts: Tuple[Tuple[int, ...], ...],
+                 lengths: Tuple[int, ...]):
+        self.entry = entry
+        self.text = text
+        self.terms = terms
+        self.field_counts = field_counts
+        self.lengths = lengths
+        self.norms: Tuple[float, ...] = ()
+        self.category = normalize_category(entry.get('category', 'general'))
+        self.updated_at = entry.get('updated_at')
+
+    def is_current(self, entry: Dict) -> bool:
+        """Whether entry is the same revision this document was built from"""
+        if self.updated_at is None or entry.get('updated_at') is None:
+            return entry == self.entry
+        return entry.get('updated_at') == self.updated_at
+
+
+class KnowledgeIndex:
+    """In-memory inverted index over the knowledge base
+
+    postings maps term -> {knowledge_id: per-field term frequencies}, with the
+    frequencies ordered like FIELDS. The index is built once per worker and
+    patched in place when knowledge is added, updated or deleted, so a query
+    only touches the postings of its own terms.
+    """
+
+    def __init__(self, fuzzy_threshold: float = FUZZY_TRIGRAM_THRESHOLD, vocabulary: Optional[SearchVocabulary] = None):
+        self.lock = threading.RLock()
+        self.vocabulary = vocabulary or SearchVocabulary()
+        self.postings: Dict[str, Dict[str, Tuple[int, ...]]] = {}
+        self.docs: Dict[str, IndexedDoc] = {}
+        # category -> knowledge ids, so searches can be limited to some partitions
+        self.categories: Dict[str, Set[str]] = {}
+
+        # trigram -> vocabulary terms containing it, for fuzzy candidate lookup
+        self.trigram_index: Dict[str, Set[str]] = {}
+        self.fuzzy_threshold = fuzzy_threshold
+
+        # Symmetric-delete dictionary of the vocabulary for query typo correction
+        self.spelling = SymSpellDictionary()
+        self.version: Optional[str] = None
+        self.built = False
+        self.built_at = 0.0
+        # Bumped on every change so derived structures know when to rebuild
+        self.generation = 0
+
+        # Corpus statistics for BM25F, recomputed lazily after changes
+        self.idf: Dict[str, float] = {}
+        self._field_length_totals = [0] * len(FIELDS)
+        self._stats_dirty = True
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    @property
+    def term_count(self) -> int:
+        return len(self.postings)
+
+    def build(self, knowledge_data: Dict, version: Optional[str] = None, vocabulary: Optional[SearchVocabulary] = None):
+        """Rebuild the whole index from the raw `knowledge` node, optionally with new vocabulary tables"""
+        with self.lock:
+            if vocabulary is not None:
+                self.vocabulary = vocabulary
+            self.postings = {}
+            self.docs = {}
+            self.categories = {}
+            self.trigram_index = {}
+            self.spelling.clear()
+            self._field_length_totals = [0] * len(FIELDS)
+            for knowledge_id, entry in (knowledge_data or {}).items():
+                if isinstance(entry, dict):
+                    self._add(knowledge_id, entry)
+            self.version = version
+            self.generation += 1
+            self.built = True
+            self.built_at = time.monotonic()
+
+    def refresh(self, knowledge_data: Dict, version: Optional[str] = None, vocabulary: Optional[SearchVocabulary] = None) -> int:
+        """Bring the index up to date with the raw `knowledge` node
+
+        Only entries whose updated_at changed (or that were added or deleted)
+        are re-tokenized; an empty index, or one compiled with different
+        vocabulary tables, is built from scratch. Returns the number of
+        entries that were reindexed or dropped.
+        """
+        with self.lock:
+            if not self.docs or (vocabulary is not None and vocabulary != self.vocabulary):
+                self.build(knowledge_data, version, vocabulary)
+                return len(self.docs)
+
+            knowledge_data = knowledge_data or {}
+            changed = 0
+            for knowledge_id in [knowledge_id for knowledge_id in self.docs if not isinstance(knowledge_data.get(knowledge_id), dict)]:
+                self._remove(knowledge_id)
+                changed += 1
+            for knowledge_id, entry in knowledge_data.items():
+                if not isinstance(entry, dict):
+                    continue
+                doc = self.docs.get(knowledge_id)
+                if doc is not None and doc.is_current(entry):
+                    continue
+                self._remove(knowledge_id)
+                self._add(knowledge_id, entry)
+                changed += 1
+
+            self.version = version
+            self.built = True
+            self.built_at = time.monotonic()
+            return changed
+
+    def invalidate(self):
+        """Mark the index stale so the next search rebuilds it"""
+        with self.lock:
+            self.built = False
+
+    def add(self, knowledge_id: str, entry: Dict):
+        with self.lock:
+            self._remove(knowledge_id)
+            self._add(knowledge_id, entry)
+
+    def update(self, knowledge_id: str, changes: Dict):
+        """Apply a partial update; None values remove the field like in Firebase"""
+        with self.lock:
+            entry = dict(self.docs[knowledge_id].entry) if knowledge_id in self.docs else {}
+            for key, value in changes.items():
+                if value is None:
+                    entry.pop(key, None)
+                else:
+                    entry[key] = value
+            self._remove(knowledge_id)
+            self._add(knowledge_id, entry)
+
+    def remove(self, knowledge_id: str):
+        with self.lock:
+            self._remove(knowledge_id)
+
+    def _add(self, knowledge_id: str, entry: Dict):
+        field_counts: Dict[str, List[int]] = {}
+        lengths = []
+        stop_words = self.vocabulary.stop_words
+        for position, field in enumerate(FIELDS):
+            tokens = tokenize(entry.get(field, ''))
+            field_terms = [sys.intern(term) for term in tokens if term not in stop_words]
+            lengths.append(len(field_terms))
+            self._field_length_totals[position] += len(field_terms)
+            # Synonyms also count under their head; they don't add to the field length
+            for term in field_terms + self.vocabulary.synonym_heads(tokens):
+                counts = field_counts.get(term)
+                if counts is None:
+                    counts = field_counts[term] = [0] * len(FIELDS)
+                counts[position] += 1
+
+        postings = []
+        for term, counts in field_counts.items():
+            term_postings = self.postings.get(term)
+            if term_postings is None:
+                term_postings = self.postings[term] = {}
+                self._add_vocabulary_term(term)
+            counts = term_postings[knowledge_id] = tuple(counts)
+            postings.append(counts)
+
+        text = ' '.join(str(entry.get(field, '')) for field in FIELDS).lower()
+        doc = self.docs[knowledge_id] = IndexedDoc(entry, text, tuple(field_counts), tuple(postings), tuple(lengths))
+        self.categories.setdefault(doc.category, set()).add(knowledge_id)
+        self._stats_dirty = True
+        self.generation += 1
+
+    def _remove(self, knowledge_id: str):
+        doc = self.docs.pop(knowledge_id, None)
+        if not doc:
+            return
+        partition = self.categories.get(doc.category)
+        if partition is not None:
+            partition.discard(knowledge_id)
+            if not partition:
+                del self.categories[doc.category]
+        for position, length in enumerate(doc.lengths):
+            self._field_length_totals[position] -= length
+        self._stats_dirty = True
+        self.generation += 1
+        for term in doc.terms:
+            term_postings = self.postings.get(term)
+            if term_postings is None:
+                continue
+            term_postings.pop(knowledge_id, None)
+            if not term_postings:
+                del self.postings[term]
+                self._remove_vocabulary_term(term)
+
+    def _add_vocabulary_term(self, term: str):
+        self.spelling.add_word(term)
+        if len(term) <= 3:
+            return
+        for trigram in trigrams(term):
+            self.trigram_index.setdefault(trigram, set()).add(term)
+
+    def _remove_vocabulary_term(self, term: str):
+        self.spelling.remove_word(term)
+        if len(term) <= 3:
+            return
+        for trigram in trigrams(term):
+            terms = self.trigram_index.get(trigram)
+            if terms is None:
+                continue
+            terms.discard(term)
+            if not terms:
+                del self.trigram_index[trigram]
+
+    def partition(self, categories: Optional[Iterable[str]]) -> Optional[Set[str]]:
+        """Knowledge ids in the given categories, or None when no filter applies"""
+        if not categories:
+            return None
+        allowed = set()
+        for category in categories:
+            allowed.update(self.categories.get(normalize_category(category), ()))
+        return allowed
+
+    def get_entry(self, knowledge_id: str) -> Optional[Dict]:
+        doc = self.docs.get(knowledge_id)
+        return doc.entry if doc else None
+
+    def term_postings(self, term: str) -> Dict[str, Tuple[int, ...]]:
+        return self.postings.get(term, {})
+
+    def docs_with_all(self, terms: Iterable[str]) -> Set[str]:
+        """Intersect posting lists, starting from the rarest term"""
+        posting_lists = sorted((self.postings.get(term, {}) for term in set(terms)), key=len)
+        if not posting_lists or not posting_lists[0]:
+            return set()
+        result = set(posting_lists[0])
+        for term_postings in posting_lists[1:]:
+            result.intersection_update(term_postings)
+            if not result:
+                break
+        return result
+
+    def phrase_matches(self, phrase: str, allowed: Optional[Set[str]] = None) -> Set[str]:
+        """Entries whose combined text contains the phrase verbatim
+
+        Candidates come from the posting intersection of the phrase tokens
+        (stop words have no postings), only those are checked against the
+        stored text. allowed limits the result to a category partition.
+        """
+        terms = [term for term in tokenize(phrase) if term not in self.vocabulary.stop_words]
+        if not terms:
+            return set()
+        candidates = self.docs_with_all(terms)
+        if allowed is not None:
+            candidates &= allowed
+        # Postings of synonym heads include folded synonyms, so those still need the text check
+        if len(terms) == 1 and phrase == terms[0] and terms[0] not in self.vocabulary.heads:
+            return candidates
+        return {knowledge_id for knowledge_id in candidates if phrase in self.docs[knowledge_id].text}
+
+    def similar_terms(self, word: str, min_similarity: float = 0.7) -> List[str]:
+        """Vocabulary terms that look like a typo or variation of word
+
+        Candidates are the terms sharing enough trigrams with word (Dice overlap
+        of at least fuzzy_threshold); only the best FUZZY_MAX_CANDIDATES of them
+        are verified with the substring / character similarity check.
+        """
+        if len(word) <= 3:
+            return []
+
+        word_trigrams = trigrams(word)
+        shared_counts: Dict[str, int] = defaultdict(int)
+        for trigram in word_trigrams:
+            for term in self.trigram_index.get(trigram, ()):
+                shared_counts[term] += 1
+
+        candidates = []
+        for term, shared in shared_counts.items():
+            if term == word:
+                continue
+            overlap = 2 * shared / (len(word_trigrams) + len(term) + 1)
+            if overlap >= self.fuzzy_threshold:
+                candidates.append((overlap, term))
+
+        return [
+            term for _, term in heapq.nlargest(FUZZY_MAX_CANDIDATES, candidates)
+            if word in term or term in word or character_similarity(word, term) > min_similarity
+        ]
+
+    def correct_spelling(self, text: str, protected: Container[str] = ()) -> str:
+        """Replace unknown words in text with their closest vocabulary term
+
+        Stop words, synonyms and other protected words are left alone, as are
+        words with no close match. Punctuation and spacing are preserved.
+        """
+        def correct(match):
+            word = match.group(0)
+            if word in protected or word in self.vocabulary.protected or word in self.postings:
+                return word
+            correction = self.spelling.lookup(word, lambda term: len(self.postings.get(term, ())))
+            return correction or word
+
+        with self.lock:
+            return _TOKEN_RE.sub(correct, text.lower())
+
+    def _refresh_stats(self):
+        """Recompute the IDF table and per-document length norms after corpus changes"""
+        if not self._stats_dirty:
+            return
+        total_docs = len(self.docs)
+        average_lengths = [
+            (total / total_docs) if total_docs and total else 1.0
+            for total in self._field_length_totals
+        ]
+
+        self.idf = {
+            term: math.log(1 + (total_docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for term, term_postings in self.postings.items()
+        }
+        for doc in self.docs.values():
+            doc.norms = tuple(
+                1 - BM25_B + BM25_B * length / average
+                for length, average in zip(doc.lengths, average_lengths)
+            )
+        self._stats_dirty = False
+
+    def bm25f_scores(self, weighted_terms: Dict[str, float], allowed: Optional[Set[str]] = None) -> Dict[str, float]:
+        """BM25F score of every entry that contains at least one of the terms
+
+        weighted_terms maps a query term to its query-side weight, so expansions
+        such as fuzzy variants can count for less than the terms the user typed.
+        allowed limits scoring to a category partition; IDF stays corpus-wide.
+        """
+        with self.lock:
+            self._refresh_stats()
+            scores: Dict[str, float] = defaultdict(float)
+            for term, query_weight in weighted_terms.items():
+                idf = self.idf.get(term)
+                if idf is None:
+                    continue
+                term_postings = self.postings[term]
+                if allowed is None:
+                    candidates = term_postings.items()
+                elif len(allowed) < len(term_postings):
+                    # Walk the smaller side: the partition instead of a long posting list
+                    candidates = [(knowledge_id, term_postings[knowledge_id]) for knowledge_id in allowed if knowledge_id in term_postings]
+                else:
+                    candidates = [(knowledge_id, field_counts) for knowledge_id, field_counts in term_postings.items() if knowledge_id in allowed]
+                for knowledge_id, field_counts in candidates:
+                    tf = _weighted_tf(field_counts, self.docs[knowledge_id].norms)
+                    scores[knowledge_id] += query_weight * idf * tf / (BM25_K1 + tf)
+            return scores
+
+    def bm25f_breakdown(self, weighted_terms: Dict[str, float], knowledge_id: str) -> Dict[str, Dict]:
+        """Per-term contribution to one entry's BM25F score, for explain output"""
+        with self.lock:
+            self._refresh_stats()
+            doc = self.docs.get(knowledge_id)
+            if doc is None:
+                return {}
+            breakdown = {}
+            for term, query_weight in weighted_terms.items():
+                field_counts = self.postings.get(term, {}).get(knowledge_id)
+                if not field_counts:
+                    continue
+                idf = self.idf[term]
+                tf = _weighted_tf(field_counts, doc.norms)
+                breakdown[term] = {
+                    'query_weight': query_weight,
+                    'idf': round(idf, 4),
+                    'fields': {field: count for field, count in zip(FIELDS, field_counts) if count},
+                    'tf': round(tf, 4),
+                    'score': round(query_weight * idf * tf / (BM25_K1 + tf), 4)
+                }
+            return breakdown
+
+
+def _weighted_tf(field_counts: Tuple[int, ...], norms: Tuple[float, ...]) -> float:
+    """BM25F pseudo term frequency: field-weighted counts, each normalized by field length"""
+    return sum(
+        weight * count / norm
+        for weight, count, norm in zip(BM25F_FIELD_WEIGHTS, field_counts, norms)
+        if count
+    )
+
+
+def top_k(scores: Dict[str, float], k: int, boosted: Iterable[str] = ()) -> List[Tuple[str, float]]:
+    """Best k (knowledge_id, score) pairs using a bounded heap; boosted ids rank first"""
+    boosted = set(boosted)
+    return heapq.nlargest(k, scores.items(), key=lambda item: (item[0] in boosted, item[1]))
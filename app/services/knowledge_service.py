@@ -1,14 +1,96 @@
 from app.config.firebase_config import get_db
-from typing import List, Dict, Optional, Union
+from app.services.change_log import collect_changes, record_deletion, sync_token
+from app.services.knowledge_index import (
+    BM25_FUZZY_WEIGHT, BM25_RELATIVE_CUTOFF, FUZZY_TRIGRAM_THRESHOLD, KnowledgeIndex, SearchVocabulary,
+    normalize_category, tokenize, top_k
+)
+from app.services.search_cache import SearchCache
+from app.services.search_trace import NULL_TRACE, SearchTrace
+from app.services.vector_search import NUMPY_AVAILABLE, BackgroundVectorBuild, LatentSemanticIndex, TfidfMatrix
+from typing import Callable, List, Dict, Optional, Set, Tuple, Union
+from collections import defaultdict
+import base64
+import bisect
+import json
+import os
+import re
+import time
 import uuid
 from datetime import datetime, timezone, timedelta
 
 # WIB Timezone (GMT+7)
 WIB = timezone(timedelta(hours=7))
 
+# Default synonym and stop word tables, used until admins save their own
+# under the `search_vocabulary` node
+DEFAULT_SYNONYMS = {
+    'rektor': ['kepala', 'pimpinan', 'pemimpin', 'direktur', 'ketua'],
+    'universitas': ['kampus', 'perguruan tinggi', 'univ', 'pt'],
+    'prabumulih': ['prabumullih', 'prabumullih'],
+    'nama': ['siapa', 'namanya', 'identitas'],
+    'tau': ['tahu', 'kenal', 'mengetahui'],
+    'dari': ['di', 'pada', 'untuk'],
+    'adalah': ['yaitu', 'ialah', 'merupakan'],
+    'logo': ['lambang', 'simbol', 'emblem'],
+    'gambar': ['foto', 'image', 'picture']
+}
+
+# Common stop words that don't add meaning
+DEFAULT_STOP_WORDS = {'yang', 'adalah', 'dan', 'atau', 'di', 'ke', 'dari', 'untuk', 'dengan', 
+                      'pada', 'dalam', 'ini', 'itu', 'ya', 'sih', 'kah', 'ga', 'tidak', 'bukan',
+                      'kan', 'dong', 'kok', 'gimana', 'bagaimana', 'apa', 'kapan', 'dimana'}
+
+# Characters Firebase doesn't allow in keys, replaced in knowledge_stats category counters
+STATS_KEY_FORBIDDEN = re.compile(r'[.$#\[\]/]')
+
+# Orderings supported by list_knowledge and the largest page it returns
+KNOWLEDGE_ORDER_FIELDS = ('id', 'updated_at', 'category')
+KNOWLEDGE_MAX_PAGE_SIZE = 200
+
+# Queries ranked per index.lock acquisition by a tfidf batch search (other modes take
+# one query at a time), so chat searches in the same worker can interleave
+SEARCH_BATCH_CHUNK_QUERIES = 20
+# A batch interrupted by a write starts over this many times; the next attempt
+# ranks its queries under one index.lock hold so it always completes
+SEARCH_BATCH_MAX_RESTARTS = 2
+
+def parse_categories(value) -> Optional[List[str]]:
+    """Normalize a category filter from a request: a name, a comma-separated string or a list
+    Returns None when no filter was given
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    categories = sorted({normalize_category(category) for category in value if str(category).strip()})
+    return categories or None
+
 class KnowledgeService:
     def __init__(self):
-        pass  # Don't store db_ref in init, get it fresh each time
+        # Don't store db_ref in init, get it fresh each time.
+        # The search index lives per worker and is checked against knowledge_meta/version.
+        self.index = KnowledgeIndex(
+            fuzzy_threshold=float(os.getenv('KNOWLEDGE_FUZZY_THRESHOLD', str(FUZZY_TRIGRAM_THRESHOLD)))
+        )
+        self._index_checked_at = 0.0
+        self.index_check_interval = float(os.getenv('KNOWLEDGE_INDEX_CHECK_SECONDS', '5'))
+        self.index_max_age = float(os.getenv('KNOWLEDGE_INDEX_MAX_AGE_SECONDS', '300'))
+        self.search_mode = os.getenv('KNOWLEDGE_SEARCH_MODE', 'bm25')
+        self.hybrid_alpha = float(os.getenv('KNOWLEDGE_HYBRID_ALPHA', '0.6'))
+        # Vector backends, rebuilt in the background when the index generation changes
+        self._tfidf = BackgroundVectorBuild('TF-IDF matrix', TfidfMatrix)
+        self._lsa = BackgroundVectorBuild('latent semantic index', LatentSemanticIndex)
+        # Ranked results per normalized query, stamped with the index generation
+        self.search_cache = SearchCache(
+            max_size=int(os.getenv('KNOWLEDGE_CACHE_SIZE', '1024')),
+            ttl_seconds=float(os.getenv('KNOWLEDGE_CACHE_TTL_SECONDS', '300'))
+        )
+        # order_by -> (index generation, sorted (sort value, id) keys) for list_knowledge
+        self._list_orders = {}
+        if self.search_mode in ('tfidf', 'hybrid') and not NUMPY_AVAILABLE:
+            print(f"⚠️ KNOWLEDGE_SEARCH_MODE={self.search_mode} needs numpy, falling back to bm25")
     
     def get_db_ref(self):
         return get_db()
@@ -32,6 +114,116 @@ class KnowledgeService:
             print(f"Error getting knowledge: {e}")
             return []
     
+    def list_knowledge(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None,
+                       order_by: str = 'id', order: str = 'asc', query: Optional[str] = None,
+                       categories: Optional[List[str]] = None) -> Dict:
+        """Page through knowledge entries from this worker's index
+        
+        Args:
+            limit: Page size (capped at KNOWLEDGE_MAX_PAGE_SIZE), None returns everything
+            after: Cursor from a previous page's next_cursor
+            fields: Fields to return per entry ('id' is always included), None returns all
+            order_by: 'id' (creation order), 'updated_at' or 'category'
+            order: 'asc' or 'desc'
+            query: Only entries whose question, answer or keywords contain this text (case-insensitive)
+            categories: Only entries in these (normalized) categories
+        
+        Returns {'items', 'next_cursor' (None on the last page), 'total'};
+        total counts the entries matching the filters.
+        Raises ValueError for an unknown ordering or a malformed cursor.
+        """
+        if order_by not in KNOWLEDGE_ORDER_FIELDS:
+            raise ValueError(f"order_by must be one of: {', '.join(KNOWLEDGE_ORDER_FIELDS)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+        if limit is not None:
+            limit = max(1, min(limit, KNOWLEDGE_MAX_PAGE_SIZE))
+        cursor_key = self._decode_cursor(after, order_by, order) if after else None
+        
+        # A page must reflect writes from other workers, so always compare versions
+        index = self._ensure_index(check_version=True)
+        needle = (query or '').strip().lower()
+        with index.lock:
+            keys = self._sorted_keys(index, order_by)
+            if needle or categories:
+                keys = [key for key in keys if self._matches_filter(index.docs[key[1]], needle, categories)]
+            if order == 'asc':
+                start = bisect.bisect_right(keys, cursor_key) if cursor_key else 0
+                end = len(keys) if limit is None else min(start + limit, len(keys))
+                page = keys[start:end]
+                has_more = end < len(keys)
+            else:
+                end = bisect.bisect_left(keys, cursor_key) if cursor_key else len(keys)
+                start = 0 if limit is None else max(end - limit, 0)
+                page = keys[start:end][::-1]
+                has_more = start > 0
+            
+            items = [self._project(knowledge_id, index.get_entry(knowledge_id), fields) for _, knowledge_id in page]
+            total = len(keys)
+        
+        return {
+            'items': items,
+            'next_cursor': self._encode_cursor(order_by, order, page[-1]) if has_more and page else None,
+            'total': total
+        }
+    
+    def get_knowledge_changes(self, since: datetime) -> Dict:
+        """Entries created or updated since a previous sync, plus tombstones of deleted ones"""
+        token = sync_token()
+        index = self._ensure_index(check_version=True)
+        with index.lock:
+            records = [self._project(knowledge_id, doc.entry, None) for knowledge_id, doc in index.docs.items()]
+        return collect_changes(self.get_db_ref(), 'knowledge', records, since, ('updated_at', 'created_at'), token)
+    
+    def _sorted_keys(self, index: KnowledgeIndex, order_by: str) -> List[Tuple[str, str]]:
+        """(sort value, id) keys of every entry in ascending order, cached per index generation"""
+        cached = self._list_orders.get(order_by)
+        if cached and cached[0] == index.generation:
+            return cached[1]
+        if order_by == 'id':
+            keys = sorted(('', knowledge_id) for knowledge_id in index.docs)
+        elif order_by == 'category':
+            keys = sorted((doc.category, knowledge_id) for knowledge_id, doc in index.docs.items())
+        else:
+            keys = sorted((str(doc.entry.get(order_by) or ''), knowledge_id) for knowledge_id, doc in index.docs.items())
+        self._list_orders[order_by] = (index.generation, keys)
+        return keys
+    
+    @staticmethod
+    def _matches_filter(doc, needle: str, categories: Optional[List[str]]) -> bool:
+        """Whether an indexed entry passes list_knowledge's text and category filters"""
+        if categories and doc.category not in categories:
+            return False
+        if not needle:
+            return True
+        return any(needle in str(doc.entry.get(field) or '').lower() for field in ('question', 'answer', 'keywords'))
+    
+    @staticmethod
+    def _project(knowledge_id: str, entry: Dict, fields: Optional[List[str]]) -> Dict:
+        """Copy of an entry with its id, limited to the requested fields"""
+        if fields is None:
+            item = dict(entry)
+        else:
+            item = {field: entry[field] for field in fields if field in entry}
+        item['id'] = knowledge_id
+        return item
+    
+    @staticmethod
+    def _encode_cursor(order_by: str, order: str, key: Tuple[str, str]) -> str:
+        payload = json.dumps([order_by, order, key[0], key[1]], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str, order_by: str, order: str) -> Tuple[str, str]:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            cursor_order_by, cursor_order, value, knowledge_id = json.loads(base64.urlsafe_b64decode(padded))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if (cursor_order_by, cursor_order) != (order_by, order):
+            raise ValueError('Cursor was issued for a different ordering')
+        return str(value), str(knowledge_id)
+    
     def get_knowledge_by_id(self, knowledge_id: str) -> Optional[Dict]:
         """Get single knowledge entry by ID"""
         try:
@@ -47,105 +239,128 @@ class KnowledgeService:
             print(f"Error getting knowledge by ID: {e}")
             return None
     
-    def search_knowledge(self, query: str) -> Dict:
-        """Search for relevant knowledge based on query with improved semantic matching
-        Returns dict with 'context' (text) and 'image_url' (if available)
+    def _ensure_index(self, check_version: bool = False) -> KnowledgeIndex:
+        """Return this worker's knowledge index, refreshing it when another worker changed the corpus
+        
+        The remote version is compared at most every index_check_interval seconds,
+        or on every call with check_version=True.
         """
+        index = self.index
+        now = time.monotonic()
+        if index.built and not check_version and now - self._index_checked_at < self.index_check_interval \
+                and now - index.built_at < self.index_max_age:
+            return index
+
+        db_ref = self.get_db_ref()
+        remote_version = db_ref.child('knowledge_meta').child('version').get()
+        self._index_checked_at = now
+
+        if not index.built or remote_version != index.version or now - index.built_at >= self.index_max_age:
+            knowledge_data = db_ref.child('knowledge').get()
+            changed = index.refresh(
+                knowledge_data if isinstance(knowledge_data, dict) else {}, remote_version,
+                self._load_vocabulary(db_ref)
+            )
+            print(f"📚 Knowledge index refreshed: {changed} changed, {len(index)} entries, {index.term_count} terms")
+        return index
+
+    def _load_vocabulary(self, db_ref) -> SearchVocabulary:
+        """Synonym and stop word tables from the `search_vocabulary` node, or the defaults"""
+        data = db_ref.child('search_vocabulary').get()
+        if not isinstance(data, dict):
+            return SearchVocabulary(DEFAULT_SYNONYMS, DEFAULT_STOP_WORDS)
+        synonyms = data.get('synonyms')
+        stop_words = data.get('stop_words')
+        return SearchVocabulary(
+            synonyms if isinstance(synonyms, dict) else {},
+            stop_words if isinstance(stop_words, list) else []
+        )
+    
+    def get_search_vocabulary(self) -> Dict:
+        """Get the synonym and stop word tables used for indexing"""
         try:
-            knowledge_list = self.get_all_knowledge()
-            relevant_context = []
-            
-            query_lower = query.lower()
-            query_words = query_lower.split()
-            
-            print(f"🔍 Searching for: '{query}' in {len(knowledge_list)} knowledge entries")
-            
-            # Define synonyms and related terms for better matching
-            synonyms = {
-                'rektor': ['kepala', 'pimpinan', 'pemimpin', 'direktur', 'ketua'],
-                'universitas': ['kampus', 'perguruan tinggi', 'univ', 'pt'],
-                'prabumulih': ['prabumullih', 'prabumullih'],
-                'nama': ['siapa', 'namanya', 'identitas'],
-                'tau': ['tahu', 'kenal', 'mengetahui'],
-                'dari': ['di', 'pada', 'untuk'],
-                'adalah': ['yaitu', 'ialah', 'merupakan'],
-                'logo': ['lambang', 'simbol', 'emblem'],
-                'gambar': ['foto', 'image', 'picture']
-            }
-            
-            # Normalize query by expanding with synonyms
-            expanded_query_words = set(query_words)
-            for word in query_words:
-                if word in synonyms:
-                    expanded_query_words.update(synonyms[word])
-            
-            # Remove common stop words that don't add meaning
-            stop_words = {'yang', 'adalah', 'dan', 'atau', 'di', 'ke', 'dari', 'untuk', 'dengan', 
-                         'pada', 'dalam', 'ini', 'itu', 'ya', 'sih', 'kah', 'ga', 'tidak', 'bukan',
-                         'kan', 'dong', 'kok', 'gimana', 'bagaimana', 'apa', 'kapan', 'dimana'}
-            
-            meaningful_words = [word for word in expanded_query_words if word not in stop_words and len(word) > 2]
+            return self._load_vocabulary(self.get_db_ref()).to_dict()
+        except Exception as e:
+            print(f"Error getting search vocabulary: {e}")
+            return SearchVocabulary(DEFAULT_SYNONYMS, DEFAULT_STOP_WORDS).to_dict()
+    
+    def update_search_vocabulary(self, synonyms: Dict[str, List[str]], stop_words: List[str]) -> bool:
+        """Save the synonym and stop word tables and recompile the index with them"""
+        try:
+            vocabulary = SearchVocabulary(synonyms, stop_words)
+            db_ref = self.get_db_ref()
+            db_ref.child('search_vocabulary').set({
+                **vocabulary.to_dict(),
+                'updated_at': datetime.now(WIB).isoformat()
+            })
+            self._sync_index(db_ref, lambda index: index.build(
+                {knowledge_id: doc.entry for knowledge_id, doc in index.docs.items()}, index.version, vocabulary
+            ))
+            print(f"✅ Search vocabulary updated: {len(vocabulary.synonyms)} synonyms, {len(vocabulary.stop_words)} stop words")
+            return True
             
-            print(f"🔍 Expanded search terms: {meaningful_words}")
+        except Exception as e:
+            print(f"❌ Error updating search vocabulary: {e}")
+            return False
+    
+    def _sync_index(self, db_ref, apply_change: Callable[[KnowledgeIndex], None]):
+        """Bump the corpus version after a write and patch the local index in place
+
+        Other workers see the new version on their next check and rebuild. If this
+        worker was already behind, its index is rebuilt too instead of patched.
+        The version is bumped in a transaction, so of two concurrent writers only
+        the one whose bump directly follows this index's version patches it.
+        """
+        try:
+            version_ref = db_ref.child('knowledge_meta').child('version')
+            new_version = uuid.uuid4().hex
+            replaced = {}
+
+            def bump(current_version):
+                # May run more than once under contention; the last call is the one committed
+                replaced['version'] = current_version
+                return new_version
+
+            version_ref.transaction(bump)
+
+            with self.index.lock:
+                if self.index.built and replaced.get('version') == self.index.version:
+                    apply_change(self.index)
+                    self.index.version = new_version
+                else:
+                    self.index.invalidate()
+        except Exception as e:
+            print(f"⚠️ Failed to sync knowledge index: {e}")
+            self.index.invalidate()
+
+    def search_knowledge(self, query: str, mode: Optional[str] = None, categories: Optional[List[str]] = None) -> Dict:
+        """Search for relevant knowledge based on query with improved semantic matching
+        Returns dict with 'context' (text), 'image_url' (if available) and
+        'corrected_query' (typo-corrected query, empty when nothing was corrected)
+        
+        Args:
+            mode: 'bm25' (BM25F ranking), 'tfidf' (NumPy TF-IDF matrix), 'hybrid'
+                (BM25F + latent semantic similarity) or 'legacy' (percentage score),
+                defaults to KNOWLEDGE_SEARCH_MODE
+            categories: Only search entries in these categories (None searches all)
+        
+        The index is compared with knowledge_meta/version on every call, so a
+        write from any worker invalidates cached results here at once.
+        """
+        try:
+            index = self._ensure_index(check_version=True)
+            mode = mode or self.search_mode
             
-            for item in knowledge_list:
-                question = item.get('question', '').lower()
-                answer = item.get('answer', '').lower()
-                keywords = item.get('keywords', '').lower()
-                category = item.get('category', '').lower()
-                
-                # Combine all searchable text
-                all_text = f"{question} {answer} {keywords} {category}"
-                
-                # Check for exact phrase match first
-                if query_lower in all_text:
-                    relevant_context.append({
-                        'content': f"Q: {item.get('question', '')}\nA: {item.get('answer', '')}",
-                        'score': 100,
-                        'match_type': 'exact',
-                        'image_url': item.get('image_url', ''),
-                        'has_image': bool(item.get('image_url'))
-                    })
-                    print(f"✅ Exact match found: {item.get('question', '')[:50]}...")
-                    continue
+            with index.lock:
+                mode = self._vector_mode(index, mode)
+                allowed = index.partition(categories)
+                query_lower, corrected_query, meaningful_words = self._prepare_query(index, query)
                 
-                # Calculate semantic similarity score
-                match_score = 0
-                matches_found = []
-                
-                for word in meaningful_words:
-                    # Direct word match
-                    if word in all_text:
-                        match_score += 2
-                        matches_found.append(word)
-                    # Partial word match (for typos or variations)
-                    else:
-                        for text_word in all_text.split():
-                            if len(word) > 3 and len(text_word) > 3:
-                                # Check for partial matches (like "prabumulih" vs "prabumullih")
-                                if (word in text_word or text_word in word or 
-                                    self._calculate_similarity(word, text_word) > 0.7):
-                                    match_score += 1
-                                    matches_found.append(f"{word}~{text_word}")
-                
-                # Calculate final score based on meaningful word matches
-                if len(meaningful_words) > 0:
-                    final_score = (match_score / len(meaningful_words)) * 100
-                    
-                    # Lower threshold for better recall
-                    if final_score >= 30:  # Reduced from 50% to 30%
-                        relevant_context.append({
-                            'content': f"Q: {item.get('question', '')}\nA: {item.get('answer', '')}",
-                            'score': final_score,
-                            'match_type': 'semantic',
-                            'matches': matches_found,
-                            'image_url': item.get('image_url', ''),
-                            'has_image': bool(item.get('image_url'))
-                        })
-                        print(f"🎯 Semantic match found: {item.get('question', '')[:50]}... (score: {final_score:.1f}%, matches: {matches_found})")
-            
-            # Sort by score (highest first)
-            relevant_context.sort(key=lambda x: x['score'], reverse=True)
+                cache_key = self._cache_key(index, mode, query_lower, meaningful_words, allowed)
+                relevant_context = self.search_cache.get(cache_key, index.generation)
+                if relevant_context is None:
+                    relevant_context = self._rank_queries(index, mode, [(query_lower, meaningful_words)], allowed=allowed)[0]
+                    self.search_cache.put(cache_key, index.generation, relevant_context)
             
             # Return top match with image if available
             result_content = []
@@ -158,32 +373,418 @@ class KnowledgeService:
                     result_image_url = item.get('image_url', '')
             
             result_text = "\n\n".join(result_content)
-            print(f"📋 Found {len(relevant_context)} matches, returning {min(3, len(relevant_context))}")
-            if result_image_url:
-                print(f"🖼️ Image found: {result_image_url}")
             
             return {
                 'context': result_text,
-                'image_url': result_image_url
+                'image_url': result_image_url,
+                'corrected_query': corrected_query
             }
             
         except Exception as e:
             print(f"❌ Error searching knowledge: {e}")
-            return {'context': '', 'image_url': ''}
+            return {'context': '', 'image_url': '', 'corrected_query': ''}
     
-    def _calculate_similarity(self, word1: str, word2: str) -> float:
-        """Calculate similarity between two words using simple character overlap"""
-        if not word1 or not word2:
-            return 0.0
+    def search_knowledge_batch(self, queries: List[str], mode: Optional[str] = None, limit: int = 3,
+                               categories: Optional[List[str]] = None, check_version: bool = False) -> List[Dict]:
+        """Rank knowledge for many queries
         
-        # Simple character-based similarity
-        set1 = set(word1.lower())
-        set2 = set(word2.lower())
+        Every query is answered against the same corpus snapshot. index.lock
+        is released between queries so a large batch doesn't hold up other
+        searches; if a write lands mid-batch (the index generation changes)
+        the batch starts over, and after SEARCH_BATCH_MAX_RESTARTS it ranks
+        all queries in one lock hold. In 'tfidf' mode
+        SEARCH_BATCH_CHUNK_QUERIES queries at a time are scored with a
+        single matrix product.
+        categories limits every query to those partitions.
+        check_version compares the index with knowledge_meta/version first, for
+        responses tagged with that version (see conditional_get).
+        Returns one {'query', 'corrected_query', 'matches'} dict per query.
+        """
+        try:
+            index = self._ensure_index(check_version=check_version)
+            mode = mode or self.search_mode
+            
+            prepared = []
+            ranked = []
+            generation = None
+            restarts = 0
+            while len(prepared) < len(queries):
+                if prepared:
+                    # Let threads waiting for the lock in before the next chunk
+                    time.sleep(0)
+                with index.lock:
+                    if generation != index.generation:
+                        if generation is not None:
+                            restarts += 1
+                        # Start (over) on the current corpus; the mode is fixed per snapshot
+                        # so a vector build finishing mid-batch doesn't change it either
+                        generation = index.generation
+                        batch_mode = self._vector_mode(index, mode)
+                        allowed = index.partition(categories)
+                        prepared, ranked = [], []
+                    if restarts >= SEARCH_BATCH_MAX_RESTARTS:
+                        chunk_size = len(queries)
+                    else:
+                        chunk_size = SEARCH_BATCH_CHUNK_QUERIES if batch_mode == 'tfidf' else 1
+                    chunk = [self._prepare_query(index, query) for query in queries[len(prepared):len(prepared) + chunk_size]]
+                    ranked.extend(self._rank_queries(
+                        index, batch_mode,
+                        [(query_lower, meaningful_words) for query_lower, _, meaningful_words in chunk],
+                        limit, allowed
+                    ))
+                prepared.extend(chunk)
+            
+            return [
+                {
+                    'query': query,
+                    'corrected_query': corrected_query,
+                    'matches': [
+                        {
+                            'id': match['id'],
+                            'question': match['question'],
+                            'score': match['score'],
+                            'match_type': match['match_type'],
+                            'image_url': match['image_url']
+                        }
+                        for match in relevant_context[:limit]
+                    ]
+                }
+                for query, (_, corrected_query, _), relevant_context in zip(queries, prepared, ranked)
+            ]
+            
+        except Exception as e:
+            print(f"❌ Error in batch knowledge search: {e}")
+            return []
+    
+    def explain_search(self, query: str, mode: Optional[str] = None, categories: Optional[List[str]] = None,
+                       limit: int = 3) -> Dict:
+        """Run one search through the normal ranking path and report how it got its result
+        
+        Returns the normalized query and its terms, candidate counts per stage,
+        a per-term BM25F breakdown for every match and wall-clock timings
+        (ms) for fetch, tokenize, score and rank. The search cache is bypassed.
+        """
+        trace = SearchTrace()
+        mode = mode or self.search_mode
+        started = time.perf_counter()
+        
+        with trace.stage('fetch'):
+            index = self._ensure_index()
+        
+        with index.lock:
+            mode = self._vector_mode(index, mode)
+            with trace.stage('tokenize'):
+                allowed = index.partition(categories)
+                query_lower, corrected_query, meaningful_words = self._prepare_query(index, query)
+            relevant_context = self._rank_queries(index, mode, [(query_lower, meaningful_words)], limit, allowed, trace)[0]
+            
+            weighted_terms = trace.details.get('weighted_terms') or self._weighted_terms(index, meaningful_words)
+            query_tokens = tokenize(query_lower)
+            hybrid_parts = trace.details.get('hybrid_parts')
+            matches = []
+            for match in relevant_context[:limit]:
+                explained = {
+                    'id': match['id'],
+                    'question': match['question'],
+                    'category': index.docs[match['id']].category,
+                    'score': match['score'],
+                    'match_type': match['match_type'],
+                    'terms': index.bm25f_breakdown(weighted_terms, match['id'])
+                }
+                if hybrid_parts is not None:
+                    explained['semantic_similarity'] = round(hybrid_parts['semantic'].get(match['id'], 0.0), 4)
+                matches.append(explained)
+            
+            candidates = {
+                'corpus': len(index),
+                'partition': None if allowed is None else len(allowed),
+                'postings': {term: len(index.term_postings(term)) for term in weighted_terms},
+                **trace.candidates
+            }
+            normalization = {
+                'query_lower': query_lower,
+                'corrected_query': corrected_query,
+                'stop_words_removed': [word for word in dict.fromkeys(query_tokens) if word in index.vocabulary.stop_words],
+                'meaningful_words': meaningful_words,
+                'synonyms': {word: list(index.vocabulary.synonyms[word]) for word in meaningful_words if word in index.vocabulary.synonyms},
+                'fuzzy_variants': [term for term, weight in weighted_terms.items() if weight != 1.0],
+                'weighted_terms': weighted_terms
+            }
+        
+        timings = trace.timings_ms()
+        timings['total'] = round((time.perf_counter() - started) * 1000, 3)
+        return {
+            'query': query,
+            'mode': mode,
+            'categories': categories or [],
+            'normalization': normalization,
+            'candidates': candidates,
+            'matches': matches,
+            'timings_ms': timings
+        }
+    
+    def _prepare_query(self, index: KnowledgeIndex, query: str) -> Tuple[str, str, List[str]]:
+        """Lowercase, typo-correct and tokenize a query
+        Returns (query_lower, corrected_query or '', meaningful_words)
+        """
+        query_lower = query.lower()
+        
+        # Fix typos against the corpus vocabulary before retrieval
+        corrected_query = index.correct_spelling(query_lower)
+        if corrected_query != query_lower:
+            query_lower = corrected_query
+        else:
+            corrected_query = ''
+        
+        return query_lower, corrected_query, self._meaningful_words(index, query_lower)
+    
+    def _meaningful_words(self, index: KnowledgeIndex, query_lower: str) -> List[str]:
+        """Query words without stop words; synonyms are already folded into the index postings"""
+        stop_words = index.vocabulary.stop_words
+        return [word for word in dict.fromkeys(tokenize(query_lower)) if word not in stop_words and len(word) > 2]
+    
+    def _cache_key(self, index: KnowledgeIndex, mode: str, query_lower: str, meaningful_words: List[str],
+                   allowed: Optional[Set[str]] = None) -> Tuple:
+        """Search cache key: mode, query terms, the exact-phrase hits they can't express and the partition"""
+        key = (
+            mode, tuple(sorted(meaningful_words)), frozenset(index.phrase_matches(query_lower, allowed)),
+            None if allowed is None else frozenset(allowed)
+        )
+        if mode == 'hybrid':
+            # The latent side embeds the full query text, stop words included
+            key += (' '.join(tokenize(query_lower)),)
+        return key
+    
+    def get_search_cache_stats(self) -> Dict:
+        """Hit/miss counters of this worker's search cache"""
+        return self.search_cache.stats()
+    
+    def _weighted_terms(self, index: KnowledgeIndex, meaningful_words: List[str]) -> Dict[str, float]:
+        """Map meaningful query words to index terms with their query weight"""
+        weighted_terms = {}
+        for word in meaningful_words:
+            for term in tokenize(word):
+                if index.term_postings(term):
+                    weighted_terms[term] = 1.0
+                else:
+                    # Typos count through their closest vocabulary variants, at a discount
+                    for variant in index.similar_terms(term):
+                        weighted_terms.setdefault(variant, BM25_FUZZY_WEIGHT)
+        return weighted_terms
+    
+    def _match_item(self, knowledge_id: str, item: Dict, score: float, match_type: str, matches: Optional[List[str]] = None) -> Dict:
+        """Build a ranked match from a knowledge entry"""
+        match = {
+            'id': knowledge_id,
+            'question': item.get('question', ''),
+            'content': f"Q: {item.get('question', '')}\nA: {item.get('answer', '')}",
+            'score': score,
+            'match_type': match_type,
+            'image_url': item.get('image_url', ''),
+            'has_image': bool(item.get('image_url'))
+        }
+        if matches is not None:
+            match['matches'] = matches
+        return match
+    
+    def _vector_mode(self, index: KnowledgeIndex, mode: str) -> str:
+        """mode, or 'bm25' while the vector backend it needs is missing or still being built
+        Caller holds index.lock; a missing backend starts building in the background.
+        """
+        if mode == 'tfidf':
+            return mode if NUMPY_AVAILABLE and self._tfidf.get(index) is not None else 'bm25'
+        if mode == 'hybrid':
+            return mode if NUMPY_AVAILABLE and self._lsa.get(index) is not None else 'bm25'
+        return mode
+    
+    def warm_up(self, mode: Optional[str] = None):
+        """Build the index and the vector backend of mode now, waiting for the build"""
+        mode = mode or self.search_mode
+        index = self._ensure_index()
+        if mode == 'tfidf' and NUMPY_AVAILABLE:
+            self._tfidf.get(index, wait=True)
+        elif mode == 'hybrid' and NUMPY_AVAILABLE:
+            self._lsa.get(index, wait=True)
+    
+    def _rank_queries(self, index: KnowledgeIndex, mode: str, queries: List[Tuple[str, List[str]]], limit: int = 3,
+                      allowed: Optional[Set[str]] = None, trace=NULL_TRACE) -> List[List[Dict]]:
+        """Rank (query_lower, meaningful_words) pairs with the selected mode; caller holds index.lock
+        allowed limits ranking to the ids of a category partition (None ranks everything).
+        trace collects stage timings and candidate counts for explain mode.
+        """
+        if mode == 'tfidf' and self._tfidf.get(index) is not None:
+            return self._rank_tfidf(index, queries, limit, allowed, trace)
+        if mode == 'hybrid' and self._lsa.get(index) is not None:
+            return [self._rank_hybrid(index, query_lower, meaningful_words, limit, allowed, trace) for query_lower, meaningful_words in queries]
+        if mode == 'legacy':
+            return [self._rank_legacy(index, query_lower, meaningful_words, allowed, trace) for query_lower, meaningful_words in queries]
+        return [self._rank_bm25(index, query_lower, meaningful_words, limit, allowed, trace) for query_lower, meaningful_words in queries]
+    
+    def _rank_legacy(self, index: KnowledgeIndex, query_lower: str, meaningful_words: List[str],
+                     allowed: Optional[Set[str]] = None, trace=NULL_TRACE) -> List[Dict]:
+        """Percentage score: exact phrase = 100, +2 per direct word hit, +1 per fuzzy hit"""
+        relevant_context = []
+        
+        with trace.stage('score'):
+            # Exact phrase matches only need the posting intersection of the query terms
+            exact_ids = index.phrase_matches(query_lower, allowed)
+            match_scores, matches_found = self._legacy_scores(index, meaningful_words, allowed)
+        trace.count('exact', len(exact_ids))
+        trace.count('scored', len(match_scores))
+        
+        with trace.stage('rank'):
+            for knowledge_id in exact_ids:
+                relevant_context.append(self._match_item(knowledge_id, index.get_entry(knowledge_id), 100, 'exact'))
+            
+            # Calculate final score based on meaningful word matches
+            for knowledge_id, match_score in match_scores.items():
+                if knowledge_id in exact_ids:
+                    continue
+                final_score = (match_score / len(meaningful_words)) * 100
+                
+                # Lower threshold for better recall
+                if final_score >= 30:  # Reduced from 50% to 30%
+                    item = index.get_entry(knowledge_id)
+                    relevant_context.append(self._match_item(knowledge_id, item, final_score, 'semantic', matches_found[knowledge_id]))
+            
+            # Sort by score (highest first)
+            relevant_context.sort(key=lambda x: x['score'], reverse=True)
+        trace.count('returned', len(relevant_context))
+        return relevant_context
+    
+    def _legacy_scores(self, index: KnowledgeIndex, meaningful_words: List[str],
+                       allowed: Optional[Set[str]] = None) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        """Accumulate legacy word-hit scores from the postings of each meaningful word"""
+        match_scores = defaultdict(int)
+        matches_found = defaultdict(list)
+        
+        for word in meaningful_words:
+            # Direct word match
+            direct_ids = set(index.term_postings(word))
+            if allowed is not None:
+                direct_ids &= allowed
+            for knowledge_id in direct_ids:
+                match_scores[knowledge_id] += 2
+                matches_found[knowledge_id].append(word)
+            
+            # Partial word match (for typos or variations like "prabumulih" vs "prabumullih")
+            for text_word in index.similar_terms(word):
+                for knowledge_id, field_counts in index.term_postings(text_word).items():
+                    if knowledge_id in direct_ids or allowed is not None and knowledge_id not in allowed:
+                        continue
+                    match_scores[knowledge_id] += sum(field_counts)
+                    matches_found[knowledge_id].append(f"{word}~{text_word}")
         
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
+        return match_scores, matches_found
+    
+    def _rank_bm25(self, index: KnowledgeIndex, query_lower: str, meaningful_words: List[str], limit: int = 3,
+                   allowed: Optional[Set[str]] = None, trace=NULL_TRACE) -> List[Dict]:
+        """BM25F ranking over the index; exact phrase matches always come first"""
+        with trace.stage('tokenize'):
+            weighted_terms = self._weighted_terms(index, meaningful_words)
+        trace.record('weighted_terms', weighted_terms)
+        
+        with trace.stage('score'):
+            scores = index.bm25f_scores(weighted_terms, allowed)
+            exact_ids = index.phrase_matches(query_lower, allowed)
+            for knowledge_id in exact_ids:
+                scores.setdefault(knowledge_id, 0.0)
+        trace.count('scored', len(scores))
+        trace.count('exact', len(exact_ids))
+        
+        with trace.stage('rank'):
+            best = top_k(scores, limit, boosted=exact_ids)
+            relevant_context = self._ranked_matches(index, best, exact_ids, weighted_terms, 'bm25')
+        trace.count('top_k', len(best))
+        trace.count('returned', len(relevant_context))
+        return relevant_context
+    
+    def _rank_tfidf(self, index: KnowledgeIndex, queries: List[Tuple[str, List[str]]], limit: int = 3,
+                    allowed: Optional[Set[str]] = None, trace=NULL_TRACE) -> List[List[Dict]]:
+        """Cosine ranking of a whole batch of queries with one TF-IDF matrix product"""
+        matrix = self._tfidf.get(index)
+        
+        with trace.stage('tokenize'):
+            weighted_queries = [self._weighted_terms(index, meaningful_words) for _, meaningful_words in queries]
+        if queries:
+            trace.record('weighted_terms', weighted_queries[0])
+        
+        with trace.stage('score'):
+            exact_ids = [index.phrase_matches(query_lower, allowed) for query_lower, _ in queries]
+            results = matrix.search(weighted_queries, limit, boosted=exact_ids, allowed=allowed)
+        if queries:
+            trace.count('exact', len(exact_ids[0]))
+            trace.count('top_k', len(results[0]))
+        
+        with trace.stage('rank'):
+            ranked = [
+                self._ranked_matches(index, best, query_exact_ids, weighted_terms, 'tfidf')
+                for best, query_exact_ids, weighted_terms in zip(results, exact_ids, weighted_queries)
+            ]
+        if queries:
+            trace.count('returned', len(ranked[0]))
+        return ranked
+    
+    def _rank_hybrid(self, index: KnowledgeIndex, query_lower: str, meaningful_words: List[str], limit: int = 3,
+                     allowed: Optional[Set[str]] = None, trace=NULL_TRACE) -> List[Dict]:
+        """Blend normalized BM25F with latent semantic cosine so paraphrases still find context"""
+        latent_index = self._lsa.get(index)
+        
+        with trace.stage('tokenize'):
+            weighted_terms = self._weighted_terms(index, meaningful_words)
+        trace.record('weighted_terms', weighted_terms)
         
-        return intersection / union if union > 0 else 0.0
+        with trace.stage('score'):
+            lexical_scores = index.bm25f_scores(weighted_terms, allowed)
+            best_lexical = max(lexical_scores.values(), default=0.0) or 1.0
+            
+            scores = {
+                knowledge_id: self.hybrid_alpha * score / best_lexical
+                for knowledge_id, score in lexical_scores.items()
+            }
+            semantic_matches = latent_index.search(query_lower, limit=max(10, limit * 3), allowed=allowed)
+            for knowledge_id, similarity in semantic_matches:
+                scores[knowledge_id] = scores.get(knowledge_id, 0.0) + (1 - self.hybrid_alpha) * similarity
+            
+            exact_ids = index.phrase_matches(query_lower, allowed)
+            for knowledge_id in exact_ids:
+                scores.setdefault(knowledge_id, 0.0)
+        trace.count('lexical', len(lexical_scores))
+        trace.count('semantic', len(semantic_matches))
+        trace.count('scored', len(scores))
+        trace.count('exact', len(exact_ids))
+        if trace.enabled:
+            trace.record('hybrid_parts', {
+                'alpha': self.hybrid_alpha,
+                'best_lexical': best_lexical,
+                'semantic': dict(semantic_matches)
+            })
+        
+        with trace.stage('rank'):
+            best = top_k(scores, limit, boosted=exact_ids)
+            relevant_context = self._ranked_matches(index, best, exact_ids, weighted_terms, 'hybrid')
+        trace.count('top_k', len(best))
+        trace.count('returned', len(relevant_context))
+        return relevant_context
+    
+    def _ranked_matches(self, index: KnowledgeIndex, best: List[Tuple[str, float]], exact_ids: Set[str],
+                        weighted_terms: Dict[str, float], match_type: str) -> List[Dict]:
+        """Turn ranked (knowledge_id, score) pairs into matches, dropping the weak tail"""
+        if not best:
+            return []
+        
+        # Drop weak tail matches so they don't pad the Gemini prompt
+        cutoff = max(score for _, score in best) * BM25_RELATIVE_CUTOFF
+        relevant_context = []
+        for knowledge_id, score in best:
+            if knowledge_id not in exact_ids and score < cutoff:
+                continue
+            matched_terms = [term for term in weighted_terms if knowledge_id in index.term_postings(term)]
+            relevant_context.append(self._match_item(
+                knowledge_id, index.get_entry(knowledge_id), round(score, 4),
+                'exact' if knowledge_id in exact_ids else match_type, matched_terms
+            ))
+        return relevant_context
     
     def add_knowledge(self, question: str, answer: str, category: str = "general", keywords: str = "", image_url: str = "", image_public_id: str = "") -> bool:
         """Add new knowledge entry"""
@@ -208,7 +809,10 @@ class KnowledgeService:
             print(f"🔥 Adding knowledge to database type: {type(db_ref)}")
             print(f"🔥 Database reference: {db_ref}")
             
-            knowledge_ref.push().set(new_entry)
+            new_ref = knowledge_ref.push()
+            new_ref.set(new_entry)
+            self._adjust_stats(db_ref, {category: 1}, 1)
+            self._sync_index(db_ref, lambda index: index.add(new_ref.key, new_entry))
             print(f"✅ Knowledge added successfully: {question[:50]}...")
             return True
             
@@ -224,7 +828,8 @@ class KnowledgeService:
             image_public_id: Image public_id or None to leave unchanged, empty string to remove
         """
         try:
-            knowledge_ref = self.get_db_ref().child('knowledge').child(knowledge_id)
+            db_ref = self.get_db_ref()
+            knowledge_ref = db_ref.child('knowledge').child(knowledge_id)
             updated_entry = {
                 'question': question,
                 'answer': answer,
@@ -248,7 +853,14 @@ class KnowledgeService:
                 else:
                     updated_entry['image_public_id'] = image_public_id
             
+            previous = knowledge_ref.get()
+            previous_category = previous.get('category') if isinstance(previous, dict) else None
             knowledge_ref.update(updated_entry)
+            if not isinstance(previous, dict):
+                self._adjust_stats(db_ref, {category: 1}, 1)
+            elif self._stats_key(previous_category) != self._stats_key(category):
+                self._adjust_stats(db_ref, {previous_category: -1, category: 1}, 0)
+            self._sync_index(db_ref, lambda index: index.update(knowledge_id, updated_entry))
             print(f"✅ Knowledge updated: {knowledge_id}")
             return True
             
@@ -265,8 +877,13 @@ class KnowledgeService:
             knowledge_data = self.get_knowledge_by_id(knowledge_id)
             
             # Delete from Firebase
-            knowledge_ref = self.get_db_ref().child('knowledge').child(knowledge_id)
+            db_ref = self.get_db_ref()
+            knowledge_ref = db_ref.child('knowledge').child(knowledge_id)
             knowledge_ref.delete()
+            if knowledge_data:
+                self._adjust_stats(db_ref, {knowledge_data.get('category'): -1}, -1)
+            record_deletion(db_ref, 'knowledge', knowledge_id)
+            self._sync_index(db_ref, lambda index: index.remove(knowledge_id))
             
             # Return the image public_id if exists, so it can be deleted from Cloudinary
             if knowledge_data and 'image_public_id' in knowledge_data:
@@ -279,25 +896,85 @@ class KnowledgeService:
             return False
     
     def get_knowledge_stats(self) -> Dict:
-        """Get knowledge statistics"""
+        """Get knowledge statistics from the `knowledge_stats` counters
+        
+        The counters are kept up to date by add/update/delete, so this is one
+        small read however large the corpus is. A missing node is rebuilt.
+        """
         try:
-            knowledge_list = self.get_all_knowledge()
-            total_knowledge = len(knowledge_list)
-            
-            # Count by category
-            categories = {}
-            for item in knowledge_list:
-                category = item.get('category', 'general')
-                categories[category] = categories.get(category, 0) + 1
-            
+            stats = self.get_db_ref().child('knowledge_stats').get()
+            if not isinstance(stats, dict):
+                return self.rebuild_knowledge_stats()
             return {
-                'total_knowledge': total_knowledge,
-                'categories': categories
+                'total_knowledge': stats.get('total', 0),
+                'categories': dict(stats.get('categories') or {})
             }
             
         except Exception as e:
             print(f"Error getting knowledge stats: {e}")
             return {'total_knowledge': 0, 'categories': {}}
+    
+    def rebuild_knowledge_stats(self) -> Dict:
+        """Recount the `knowledge_stats` counters from the full knowledge tree
+        
+        Repair job for counters that drifted (e.g. entries edited directly in
+        the Firebase console). Read errors propagate so a failed read never
+        overwrites the counters with zeros.
+        """
+        db_ref = self.get_db_ref()
+        knowledge_data = db_ref.child('knowledge').get()
+        categories = defaultdict(int)
+        total = 0
+        for value in (knowledge_data.values() if isinstance(knowledge_data, dict) else []):
+            if isinstance(value, dict):
+                categories[self._stats_key(value.get('category'))] += 1
+                total += 1
+        
+        db_ref.child('knowledge_stats').set({
+            'total': total,
+            'categories': dict(categories),
+            'rebuilt_at': datetime.now(WIB).isoformat()
+        })
+        # Counts may have changed without a knowledge write, so expire cached /stats responses
+        self._sync_index(db_ref, lambda index: None)
+        print(f"📊 Knowledge stats rebuilt: {total} entries in {len(categories)} categories")
+        return {'total_knowledge': total, 'categories': dict(categories)}
+    
+    @staticmethod
+    def _stats_key(category: Optional[str]) -> str:
+        return STATS_KEY_FORBIDDEN.sub('_', str(category or 'general'))
+    
+    def _adjust_stats(self, db_ref, category_deltas: Dict[Optional[str], int], total_delta: int):
+        """Apply count changes to `knowledge_stats` in one transaction
+        
+        Counters that don't exist yet are left for get_knowledge_stats to rebuild.
+        If the transaction fails the node is dropped, so the next read recounts
+        instead of serving drifted numbers.
+        """
+        def apply(current):
+            if not isinstance(current, dict):
+                return current
+            categories = dict(current.get('categories') or {})
+            for category, delta in category_deltas.items():
+                key = self._stats_key(category)
+                count = categories.get(key, 0) + delta
+                if count > 0:
+                    categories[key] = count
+                else:
+                    categories.pop(key, None)
+            current['categories'] = categories
+            current['total'] = max(current.get('total', 0) + total_delta, 0)
+            return current
+        
+        stats_ref = db_ref.child('knowledge_stats')
+        try:
+            stats_ref.transaction(apply)
+        except Exception as e:
+            print(f"⚠️ Failed to update knowledge stats, dropping them for a recount: {e}")
+            try:
+                stats_ref.delete()
+            except Exception:
+                pass
 
 # Global instance
 knowledge_service = KnowledgeService()
\ No newline at end of file
@@ -0,0 +1,91 @@
+import math
+from typing import Any, Dict, Optional
+from app.config.db_tree import as_dict
+
+# Every latency is reported within this relative error. Fixed: stored
+# histograms are only mergeable while the bucket boundaries stay the same.
+LATENCY_RELATIVE_ACCURACY = 0.02
+
+# Latencies at or below LATENCY_MIN_MS share bucket 0; above LATENCY_MAX_MS they
+# share the last bucket. That bounds a histogram to about 400 buckets.
+LATENCY_MIN_MS = 0.1
+LATENCY_MAX_MS = 10 * 60 * 1000.0
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram (HDR/DDSketch style), in milliseconds
+
+    Bucket i holds latencies in (MIN * gamma^(i-1), MIN * gamma^i] with
+    gamma = (1 + a) / (1 - a), and reports 2 * MIN * gamma^i / (gamma + 1),
+    which is within a (LATENCY_RELATIVE_ACCURACY) of everything in it.
+    Histograms are just bucket counts, so merging (across workers, batches or
+    days) is adding counts, e.g. with server-side increments, and percentiles
+    need no raw samples.
+    """
+
+    gamma = (1 + LATENCY_RELATIVE_ACCURACY) / (1 - LATENCY_RELATIVE_ACCURACY)
+    max_bucket = math.ceil(math.log(LATENCY_MAX_MS / LATENCY_MIN_MS) / math.log(gamma))
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+
+    @classmethod
+    def bucket(cls, ms: float) -> int:
+        if ms <= LATENCY_MIN_MS:
+            return 0
+        return min(cls.max_bucket, math.ceil(math.log(ms / LATENCY_MIN_MS) / math.log(cls.gamma)))
+
+    @classmethod
+    def bucket_value(cls, index: int) -> float:
+        if index <= 0:
+            return LATENCY_MIN_MS
+        return 2 * LATENCY_MIN_MS * cls.gamma ** index / (cls.gamma + 1)
+
+    @classmethod
+    def from_dict(cls, value: Any) -> 'LatencyHistogram':
+        """Histogram from stored {bucket: count}; Firebase may return dense buckets as a list"""
+        histogram = cls()
+        for key, count in as_dict(value).items():
+            try:
+                index, count = int(key), int(count)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index <= cls.max_bucket and count > 0:
+                histogram.counts[index] = histogram.counts.get(index, 0) + count
+        return histogram
+
+    def to_dict(self) -> Dict[str, int]:
+        return {str(index): count for index, count in self.counts.items()}
+
+    def record(self, ms: float, count: int = 1):
+        index = self.bucket(ms)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Nearest-rank percentile (fraction in 0..1); None when empty"""
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, math.ceil(fraction * total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.bucket_value(index)
+        return self.bucket_value(max(self.counts))
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """p50/p95/p99 in milliseconds, None when nothing was recorded"""
+        result = {}
+        for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            value = self.percentile(fraction)
+            result[name] = None if value is None else round(value, 1)
+        return result
@@ -1,19 +1,16 @@
 from datetime import datetime, timezone, timedelta
 import uuid
 from app.config.firebase_config import get_db
+from app.services.change_log import collect_changes, record_deletion, sync_token
+from app.services.collection_version import bump_collection_version
 
 # WIB Timezone (GMT+7)
 WIB = timezone(timedelta(hours=7))
 
 class ScheduleService:
-    def __init__(self):
-        self.db_ref = None
-
     def get_db_ref(self):
-        """Get database reference"""
-        if self.db_ref is None:
-            self.db_ref = get_db()
-        return self.db_ref
+        """Get database reference (cheap: the handle is resolved once per worker)"""
+        return get_db()
 
     def get_all_schedules(self):
         """Get all schedule events"""
@@ -23,21 +20,7 @@ class ScheduleService:
             data = schedules_ref.get()
 
             if data:
-                schedules = []
-                for key, value in data.items():
-                    # Support both old (date) and new (start_date/end_date) format
-                    start_date = value.get('tanggal_mulai') or value.get('start_date') or value.get('date', '')
-                    end_date = value.get('tanggal_selesai') or value.get('end_date') or value.get('date', '')
-                    
-                    schedule = {
-                        'id': key,
-                        'judul': value.get('judul') or value.get('title', 'No Title'),
-                        'tanggal_mulai': start_date,
-                        'tanggal_selesai': end_date,
-                        'dibuat_pada': value.get('dibuat_pada') or value.get('created_at', ''),
-                        'diperbarui_pada': value.get('diperbarui_pada') or value.get('updated_at', '')
-                    }
-                    schedules.append(schedule)
+                schedules = [self._format_schedule(key, value) for key, value in data.items()]
 
                 # Sort by start_date (newest first)
                 schedules.sort(key=lambda x: x.get('tanggal_mulai', ''), reverse=True)
@@ -49,6 +32,28 @@ class ScheduleService:
             print(f"❌ Error getting schedules: {e}")
             return []
 
+    @staticmethod
+    def _format_schedule(schedule_id: str, value: dict) -> dict:
+        """Schedule record in the current format"""
+        # Support both old (date) and new (start_date/end_date) format
+        start_date = value.get('tanggal_mulai') or value.get('start_date') or value.get('date', '')
+        end_date = value.get('tanggal_selesai') or value.get('end_date') or value.get('date', '')
+
+        return {
+            'id': schedule_id,
+            'judul': value.get('judul') or value.get('title', 'No Title'),
+            'tanggal_mulai': start_date,
+            'tanggal_selesai': end_date,
+            'dibuat_pada': value.get('dibuat_pada') or value.get('created_at', ''),
+            'diperbarui_pada': value.get('diperbarui_pada') or value.get('updated_at', '')
+        }
+
+    def get_schedule_changes(self, since: datetime) -> dict:
+        """Schedules created or updated since a previous sync, plus tombstones of deleted ones"""
+        token = sync_token()
+        return collect_changes(self.get_db_ref(), 'schedules', self.get_all_schedules(), since,
+                               ('diperbarui_pada', 'dibuat_pada'), token)
+
     def get_schedule_by_id(self, schedule_id: str):
         """Get schedule by ID"""
         try:
@@ -57,18 +62,7 @@ class ScheduleService:
             data = schedule_ref.get()
 
             if data:
-                # Support both old (date) and new (start_date/end_date) format
-                start_date = data.get('tanggal_mulai') or data.get('start_date') or data.get('date', '')
-                end_date = data.get('tanggal_selesai') or data.get('end_date') or data.get('date', '')
-                
-                return {
-                    'id': schedule_id,
-                    'judul': data.get('judul') or data.get('title', 'No Title'),
-                    'tanggal_mulai': start_date,
-                    'tanggal_selesai': end_date,
-                    'dibuat_pada': data.get('dibuat_pada') or data.get('created_at', ''),
-                    'diperbarui_pada': data.get('diperbarui_pada') or data.get('updated_at', '')
-                }
+                return self._format_schedule(schedule_id, data)
             else:
                 return None
 
@@ -77,15 +71,29 @@ class ScheduleService:
             return None
 
     def get_schedules_by_date_range(self, start_date: str, end_date: str):
-        """Get schedules within date range for mobile app calendar view"""
-        try:
-            all_schedules = self.get_all_schedules()
+        """Get schedules within date range for mobile app calendar view
 
-            if not start_date or not end_date:
-                return all_schedules
+        Uses a tanggal_mulai range query (indexed, see database.rules.json) so
+        only the matching schedules are downloaded.
+        """
+        if not start_date or not end_date:
+            return self.get_all_schedules()
 
+        try:
+            schedules_ref = self.get_db_ref().child('schedules')
+            in_range = schedules_ref.order_by_child('tanggal_mulai').start_at(start_date).end_at(end_date).get() or {}
+            # Old-format records have no tanggal_mulai, which orders as null: below false
+            legacy = schedules_ref.order_by_child('tanggal_mulai').end_at(False).get() or {}
+        except Exception as e:
+            print(f"⚠️ Schedule range query failed, filtering all schedules instead: {e}")
+            in_range = {schedule['id']: schedule for schedule in self.get_all_schedules()}
+            legacy = {}
+
+        try:
+            schedules = [self._format_schedule(key, value) for key, value in {**legacy, **in_range}.items()
+                         if isinstance(value, dict)]
             filtered = [
-                s for s in all_schedules 
+                s for s in schedules
                 if start_date <= s.get('tanggal_mulai', '') <= end_date
             ]
 
@@ -119,6 +127,7 @@ class ScheduleService:
             }
 
             schedules_ref.child(schedule_id).set(schedule_data)
+            bump_collection_version(db_ref, 'schedules')
             print(f"✅ Schedule created successfully with ID: {schedule_id}")
 
             return {
@@ -153,6 +162,7 @@ class ScheduleService:
             }
 
             schedule_ref.update(update_data)
+            bump_collection_version(db_ref, 'schedules')
             print(f"✅ Schedule {schedule_id} updated successfully")
             return True
 
@@ -172,6 +182,8 @@ class ScheduleService:
                 return False
 
             schedule_ref.delete()
+            record_deletion(db_ref, 'schedules', schedule_id)
+            bump_collection_version(db_ref, 'schedules')
             print(f"✅ Schedule {schedule_id} deleted successfully")
             return True
 
@@ -0,0 +1,53 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict
+
+
+class SearchTrace:
+    """Per-stage wall-clock timings, candidate counts and details of one search
+
+    Rankers take a trace and report into it as they go; normal searches pass
+    NULL_TRACE, whose methods do nothing, so explain mode measures the same
+    code path that serves chat requests.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.candidates: Dict[str, Any] = {}
+        self.details: Dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def count(self, name: str, value: Any):
+        self.candidates[name] = value
+
+    def record(self, name: str, value: Any):
+        self.details[name] = value
+
+    def timings_ms(self) -> Dict[str, float]:
+        return {name: round(elapsed, 3) for name, elapsed in self.timings.items()}
+
+
+class _NullTrace:
+    enabled = False
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def count(self, name: str, value: Any):
+        pass
+
+    def record(self, name: str, value: Any):
+        pass
+
+
+NULL_TRACE = _NullTrace()
@@ -0,0 +1,118 @@
+from typing import Callable, Dict, Optional, Set
+
+
+def edit_distance(word1: str, word2: str, max_distance: int) -> Optional[int]:
+    """Optimal string alignment distance, or None when it exceeds max_distance"""
+    if abs(len(word1) - len(word2)) > max_distance:
+        return None
+
+    previous_previous = None
+    previous = list(range(len(word2) + 1))
+    for i in range(1, len(word1) + 1):
+        current = [i] + [0] * len(word2)
+        row_min = i
+        for j in range(1, len(word2) + 1):
+            cost = 0 if word1[i - 1] == word2[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            # Adjacent transposition ("jadwla" -> "jadwal") counts as one edit
+            if i > 1 and j > 1 and word1[i - 1] == word2[j - 2] and word1[i - 2] == word2[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return None
+        previous_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+class SymSpellDictionary:
+    """Symmetric-delete spelling dictionary (SymSpell) over the corpus vocabulary
+
+    Every word is stored under all strings reachable by deleting up to
+    max_edit_distance characters from its prefix. A lookup generates the same
+    deletes for the query word, so candidates come from a handful of dict hits
+    instead of a scan of the vocabulary; only those are verified with the real
+    edit distance.
+    """
+
+    def __init__(self, max_edit_distance: int = 2, prefix_length: int = 7, min_word_length: int = 4):
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.min_word_length = min_word_length
+        self.words: Set[str] = set()
+        self.deletes: Dict[str, Set[str]] = {}
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def _deletes(self, word: str) -> Set[str]:
+        key = word[:self.prefix_length]
+        results = {key}
+        frontier = {key}
+        for _ in range(self.max_edit_distance):
+            next_frontier = set()
+            for variant in frontier:
+                if len(variant) <= 1:
+                    continue
+                for i in range(len(variant)):
+                    deleted = variant[:i] + variant[i + 1:]
+                    if deleted not in results:
+                        results.add(deleted)
+                        next_frontier.add(deleted)
+            frontier = next_frontier
+        return results
+
+    def add_word(self, word: str):
+        if len(word) < self.min_word_length or word in self.words:
+            return
+        self.words.add(word)
+        for deleted in self._deletes(word):
+            self.deletes.setdefault(deleted, set()).add(word)
+
+    def remove_word(self, word: str):
+        if word not in self.words:
+            return
+        self.words.discard(word)
+        for deleted in self._deletes(word):
+            words = self.deletes.get(deleted)
+            if words is None:
+                continue
+            words.discard(word)
+            if not words:
+                del self.deletes[deleted]
+
+    def clear(self):
+        self.words = set()
+        self.deletes = {}
+
+    def lookup(self, word: str, frequency: Optional[Callable[[str], int]] = None) -> Optional[str]:
+        """Closest known word, preferring smaller distance and then higher frequency
+
+        Returns the word itself when it is known and None when nothing is
+        close enough. The allowed distance grows with the word length, up to
+        max_edit_distance.
+        """
+        if word in self.words:
+            return word
+        if len(word) < self.min_word_length:
+            return None
+
+        # Short words allow fewer edits, otherwise "kamu" would become "nama"
+        max_distance = max(1, min(self.max_edit_distance, len(word) // 4))
+        best_word = None
+        best_key = None
+        checked = set()
+        for deleted in self._deletes(word):
+            for candidate in self.deletes.get(deleted, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                distance = edit_distance(word, candidate, max_distance)
+                if distance is None:
+                    continue
+                key = (distance, -(frequency(candidate) if frequency else 0), candidate)
+                if best_key is None or key < best_key:
+                    best_key = key
+                    best_word = candidate
+        return best_word
@@ -0,0 +1,371 @@
+import math
+import os
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; KnowledgeService falls back to BM25 without it
+    np = None
+
+from app.services.knowledge_index import BM25F_FIELD_WEIGHTS, IndexedDoc, KnowledgeIndex, tokenize
+
+NUMPY_AVAILABLE = np is not None
+
+# Latent semantic index: hashed feature space, SVD rank and randomized SVD settings
+LSA_HASH_DIMENSIONS = 2 ** 12
+LSA_RANK = 128
+LSA_OVERSAMPLING = 10
+LSA_POWER_ITERATIONS = 2
+LSA_BLOCK_ROWS = 2048
+# Scaled similarities below this are treated as no semantic match
+LSA_MIN_SIMILARITY = 0.2
+
+# Document matrix columns densified at a time when scoring a TF-IDF batch
+TFIDF_BLOCK_TERMS = 256
+
+
+class TfidfMatrix:
+    """TF-IDF document-term matrix built from a snapshot of KnowledgeIndex docs
+
+    The matrix is stored column-major and sparse (CSC: indptr / indices / data
+    numpy arrays), with L2-normalized document rows. A batch of queries is
+    scored with dense products over only the columns the batch uses, in
+    blocks of TFIDF_BLOCK_TERMS columns, and the top-k per query comes from
+    argpartition.
+    """
+
+    def __init__(self, docs: List[Tuple[str, IndexedDoc]], generation: int = 0):
+        self.generation = generation
+        self.doc_ids: List[str] = [knowledge_id for knowledge_id, _ in docs]
+        self.columns: Dict[str, int] = {}
+
+        self.positions = {knowledge_id: position for position, knowledge_id in enumerate(self.doc_ids)}
+        total_docs = len(self.doc_ids)
+
+        rows = []
+        columns = []
+        weighted_tfs = []
+        for position, (_, doc) in enumerate(docs):
+            for term, field_counts in zip(doc.terms, doc.field_counts):
+                column = self.columns.get(term)
+                if column is None:
+                    column = self.columns[term] = len(self.columns)
+                rows.append(position)
+                columns.append(column)
+                weighted_tfs.append(sum(weight * count for weight, count in zip(BM25F_FIELD_WEIGHTS, field_counts)))
+
+        columns = np.asarray(columns, dtype=np.int32)
+        document_frequency = np.bincount(columns, minlength=len(self.columns))
+        idf = np.log((1 + total_docs) / (1 + document_frequency)) + 1
+        self.idf: Dict[str, float] = {term: float(idf[column]) for term, column in self.columns.items()}
+
+        # Entries arrive grouped by document; CSC wants them grouped by term
+        order = np.argsort(columns, kind='stable')
+        self.indptr = np.concatenate(([0], np.cumsum(document_frequency))).astype(np.int64)
+        self.indices = np.asarray(rows, dtype=np.int32)[order]
+        self.data = ((1 + np.log(np.asarray(weighted_tfs, dtype=np.float64))) * idf[columns])[order].astype(np.float32)
+
+        # Normalize rows so a dot product with the query is a cosine
+        row_norms = np.sqrt(np.bincount(self.indices, weights=self.data.astype(np.float64) ** 2, minlength=total_docs))
+        row_norms[row_norms == 0] = 1.0
+        self.data /= row_norms[self.indices].astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, weighted_queries: List[Dict[str, float]], limit: int = 3,
+               boosted: List[Set[str]] = None, allowed: Optional[Set[str]] = None) -> List[List[Tuple[str, float]]]:
+        """Score a batch of queries and return the top `limit` (knowledge_id, score) per query
+
+        weighted_queries holds one {term: query weight} dict per query. Ids in
+        boosted[i] are ranked first for query i (used for exact phrase hits).
+        allowed limits the ranking to a category partition.
+        """
+        batch_terms = sorted({term for query in weighted_queries for term in query if term in self.columns})
+        if not self.doc_ids or not batch_terms or allowed is not None and not allowed:
+            return [[] for _ in weighted_queries]
+
+        term_positions = {term: position for position, term in enumerate(batch_terms)}
+        queries = np.zeros((len(batch_terms), len(weighted_queries)), dtype=np.float32)
+        for query_position, query in enumerate(weighted_queries):
+            for term, weight in query.items():
+                if term in term_positions:
+                    queries[term_positions[term], query_position] = weight * self.idf[term]
+        query_norms = np.linalg.norm(queries, axis=0)
+        query_norms[query_norms == 0] = 1.0
+        queries /= query_norms
+
+        # Dense slices of the document matrix restricted to the batch vocabulary,
+        # a block of columns at a time so the temporary stays bounded
+        scores = np.zeros((len(self.doc_ids), len(weighted_queries)), dtype=np.float32)
+        documents = np.empty((len(self.doc_ids), min(TFIDF_BLOCK_TERMS, len(batch_terms))), dtype=np.float32)
+        for first in range(0, len(batch_terms), TFIDF_BLOCK_TERMS):
+            block = batch_terms[first:first + TFIDF_BLOCK_TERMS]
+            documents.fill(0.0)
+            for offset, term in enumerate(block):
+                column = self.columns[term]
+                start, end = self.indptr[column], self.indptr[column + 1]
+                documents[self.indices[start:end], offset] = self.data[start:end]
+            scores += documents[:, :len(block)] @ queries[first:first + len(block)]
+        if allowed is not None:
+            # Cosines are >= 0, so -1 keeps other partitions out of every top-k
+            mask = np.ones(len(self.doc_ids), dtype=bool)
+            mask[[self.positions[knowledge_id] for knowledge_id in allowed if knowledge_id in self.positions]] = False
+            scores[mask] = -1.0
+
+        results = []
+        for query_position in range(len(weighted_queries)):
+            column = scores[:, query_position]
+            rank = column
+            if boosted and boosted[query_position]:
+                # Cosine never exceeds 1, so +1 puts boosted ids ahead of everything else
+                rank = column.copy()
+                rank[[self.positions[knowledge_id] for knowledge_id in boosted[query_position]]] += 1.0
+
+            k = min(limit, len(rank))
+            top = np.argpartition(-rank, k - 1)[:k]
+            top = top[np.argsort(-rank[top])]
+            results.append([
+                (self.doc_ids[position], float(column[position]))
+                for position in top if rank[position] > 0
+            ])
+        return results
+
+
+@lru_cache(maxsize=65536)
+def _word_buckets(word: str) -> Tuple[int, ...]:
+    """Hash buckets of a word feature and its character 3/4-grams"""
+    grams = [f"w:{word}"]
+    padded = f"<{word}>"
+    for size in (3, 4):
+        grams.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return tuple(zlib.crc32(gram.encode('utf-8')) % LSA_HASH_DIMENSIONS for gram in grams)
+
+
+def hashed_features(text: str) -> Dict[int, float]:
+    """Hashed word and character n-gram counts of a text
+
+    Character 3/4-grams of each word make spelling variants and inflections
+    ("rektor" / "rektornya") share features. crc32 keeps the hashing stable
+    across worker processes.
+    """
+    features: Dict[int, float] = {}
+    for word in tokenize(text):
+        for bucket in _word_buckets(word):
+            features[bucket] = features.get(bucket, 0.0) + 1.0
+    return features
+
+
+class LatentSemanticIndex:
+    """Offline latent-semantic retrieval over hashed n-gram features
+
+    Documents are hashed into a sparse feature matrix (log tf * idf), reduced
+    with a randomized truncated SVD and kept as a float32 matrix of unit-length
+    embeddings. Queries are projected the same way and ranked by cosine. No
+    network or model download is involved.
+    """
+
+    def __init__(self, docs: List[Tuple[str, IndexedDoc]], generation: int = 0, rank: int = LSA_RANK):
+        self.generation = generation
+        self.doc_ids: List[str] = [knowledge_id for knowledge_id, _ in docs]
+        self.positions = {knowledge_id: position for position, knowledge_id in enumerate(self.doc_ids)}
+
+        rows, cols, values = [], [], []
+        for position, (_, doc) in enumerate(docs):
+            entry = doc.entry
+            # The question carries most of the intent, so it counts twice
+            text = ' '.join([
+                str(entry.get('question', '')), str(entry.get('question', '')),
+                str(entry.get('keywords', '')), str(entry.get('answer', ''))
+            ])
+            for bucket, count in hashed_features(text).items():
+                rows.append(position)
+                cols.append(bucket)
+                values.append(1.0 + math.log(count))
+
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.cols = np.asarray(cols, dtype=np.int32)
+        values = np.asarray(values, dtype=np.float32)
+
+        total_docs = len(self.doc_ids)
+        self.document_frequency = np.bincount(self.cols, minlength=LSA_HASH_DIMENSIONS)
+        self.idf = (np.log((1 + total_docs) / (1 + self.document_frequency)) + 1).astype(np.float32)
+        self.values = values * self.idf[self.cols]
+
+        self.components = None
+        self.embeddings = np.zeros((total_docs, 0), dtype=np.float32)
+        if total_docs and len(self.values):
+            self._fit(min(rank, total_docs))
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def _row_blocks(self):
+        """Yield (first_row, dense_block) slices of the feature matrix
+
+        Rows are densified LSA_BLOCK_ROWS at a time so products run through
+        BLAS while the temporary stays bounded.
+        """
+        row_bounds = np.searchsorted(self.rows, np.arange(0, len(self.doc_ids) + LSA_BLOCK_ROWS, LSA_BLOCK_ROWS))
+        for block, first_row in enumerate(range(0, len(self.doc_ids), LSA_BLOCK_ROWS)):
+            low, high = row_bounds[block], row_bounds[block + 1]
+            dense_block = np.zeros((min(LSA_BLOCK_ROWS, len(self.doc_ids) - first_row), LSA_HASH_DIMENSIONS), dtype=np.float32)
+            dense_block[self.rows[low:high] - first_row, self.cols[low:high]] = self.values[low:high]
+            yield first_row, dense_block
+
+    def _multiply(self, dense):
+        """Feature matrix times a dense (features x k) matrix"""
+        result = np.zeros((len(self.doc_ids), dense.shape[1]), dtype=np.float32)
+        for first_row, dense_block in self._row_blocks():
+            result[first_row:first_row + len(dense_block)] = dense_block @ dense
+        return result
+
+    def _multiply_transposed(self, dense):
+        """Transposed feature matrix times a dense (documents x k) matrix"""
+        result = np.zeros((LSA_HASH_DIMENSIONS, dense.shape[1]), dtype=np.float32)
+        for first_row, dense_block in self._row_blocks():
+            result += dense_block.T @ dense[first_row:first_row + len(dense_block)]
+        return result
+
+    def _fit(self, rank: int):
+        """Randomized truncated SVD (Halko et al.) of the sparse feature matrix"""
+        sketch_size = min(rank + LSA_OVERSAMPLING, len(self.doc_ids), LSA_HASH_DIMENSIONS)
+        random_state = np.random.default_rng(0)
+        sample = self._multiply(random_state.standard_normal((LSA_HASH_DIMENSIONS, sketch_size)).astype(np.float32))
+        basis, _ = np.linalg.qr(sample)
+        for _ in range(LSA_POWER_ITERATIONS):
+            basis, _ = np.linalg.qr(self._multiply(self._multiply_transposed(basis)))
+
+        projected = self._multiply_transposed(basis).T
+        _, singular_values, right_vectors = np.linalg.svd(projected, full_matrices=False)
+        keep = min(rank, int(np.count_nonzero(singular_values > 1e-6)))
+        self.components = np.ascontiguousarray(right_vectors[:keep].T, dtype=np.float32)
+
+        self.embeddings = self._normalize(self._multiply(self.components))
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def embed(self, text: str) -> Tuple[Optional['np.ndarray'], float]:
+        """Unit-length latent vector of a query text and the share of its features the corpus knows
+
+        Features the corpus never uses have no latent direction; a query made
+        mostly of them projects to normalized noise, so callers scale the
+        similarity by the known share.
+        """
+        features = hashed_features(text)
+        if self.components is None or not features:
+            return None, 0.0
+        buckets = np.fromiter(features.keys(), dtype=np.int32, count=len(features))
+        counts = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+
+        known = self.document_frequency[buckets] > 0
+        if not known.any():
+            return None, 0.0
+        coverage = float(counts[known].sum() / counts.sum())
+        buckets, counts = buckets[known], counts[known]
+
+        weights = (1.0 + np.log(counts)) * self.idf[buckets]
+        vector = weights @ self.components[buckets]
+        return self._normalize(vector[None, :])[0], coverage
+
+    def search(self, text: str, limit: int = 10, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Top `limit` (knowledge_id, similarity) pairs above LSA_MIN_SIMILARITY
+
+        The similarity is the cosine scaled by the query feature coverage.
+        allowed limits the ranking to a category partition; only those rows
+        are multiplied.
+        """
+        vector, coverage = self.embed(text)
+        if vector is None or not self.doc_ids:
+            return []
+        embeddings, positions = self.embeddings, np.arange(len(self.doc_ids))
+        if allowed is not None:
+            positions = np.fromiter((self.positions[knowledge_id] for knowledge_id in allowed if knowledge_id in self.positions), dtype=np.int64)
+            if not len(positions):
+                return []
+            embeddings = self.embeddings[positions]
+        similarities = (embeddings @ vector) * coverage
+        k = min(limit, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [(self.doc_ids[positions[row]], float(similarities[row])) for row in top if similarities[row] >= LSA_MIN_SIMILARITY]
+
+
+class BackgroundVectorBuild:
+    """Latest vector backend of one kind, rebuilt off the index lock after the corpus changes
+
+    get() runs with index.lock held and only snapshots the doc list; building
+    the backend (seconds for a large corpus) happens in a daemon thread, so
+    searches never wait for it. Until the backend of the index's current
+    generation is swapped in, get() returns None and callers rank with BM25.
+    A generation whose build failed isn't retried.
+    """
+
+    def __init__(self, name: str, factory: Callable[[List[Tuple[str, IndexedDoc]], int], Any]):
+        self.name = name
+        self.factory = factory
+        self.backend = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread: Optional[threading.Thread] = None
+        self._pending: Optional[Tuple[int, List[Tuple[str, IndexedDoc]]]] = None
+        self._building: Optional[int] = None
+        self._failed: Optional[int] = None
+
+    def get(self, index: KnowledgeIndex, wait: bool = False):
+        """Backend built for index.generation, or None while it is being built
+
+        With wait=True the caller blocks until the build finishes (warm-up
+        and benchmarks); don't hold index.lock then.
+        """
+        backend = self.backend
+        if backend is not None and backend.generation == index.generation:
+            return backend
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker doesn't have the parent's build thread
+                self._pid, self._thread, self._pending, self._building = os.getpid(), None, None, None
+            generation = index.generation
+            queued = self._pending[0] if self._pending else None
+            if generation not in (self._building, queued, self._failed):
+                self._pending = (generation, list(index.docs.items()))
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f'{self.name}-build', daemon=True)
+                    self._thread.start()
+            thread = self._thread
+
+        if wait and thread is not None:
+            thread.join()
+            backend = self.backend
+            if backend is not None and backend.generation == index.generation:
+                return backend
+        return None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    self._thread = self._building = None
+                    return
+                generation, docs = self._pending
+                self._pending = None
+                self._building = generation
+
+            started = time.perf_counter()
+            try:
+                backend = self.factory(docs, generation)
+            except Exception as e:
+                self._failed = generation
+                print(f"❌ Failed to build {self.name} for {len(docs)} entries: {e}")
+                continue
+            self.backend = backend
+            print(f"🧮 {self.name} built: {len(docs)} entries in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,300 @@
+"""Knowledge search benchmark on synthetic Indonesian corpora
+
+Runs KnowledgeService.search_knowledge against the in-process MockDatabase
+(or, with --backend sqlite, a throwaway SQLite database for realistic I/O),
+so no Firebase or network access is involved. For every corpus size and
+search mode it reports index build time, peak memory of the build,
+throughput, p50/p95/p99 latency and recall@3 against the labelled entry
+each query was generated from.
+
+Usage (from the repository root):
+    python -m benchmarks.search_benchmark
+    python -m benchmarks.search_benchmark --sizes 100,1000 --modes bm25,tfidf --queries 300
+    python -m benchmarks.search_benchmark --json results.json
+    python -m benchmarks.search_benchmark --backend sqlite --sizes 1000
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+# Never pick up real Firebase credentials from the shell
+for _name in ('FIREBASE_PROJECT_ID', 'FIREBASE_PRIVATE_KEY', 'FIREBASE_CLIENT_EMAIL'):
+    os.environ.pop(_name, None)
+
+from app.config.firebase_config import MockDatabase
+from app.config.sqlite_database import SQLiteDatabase
+from app.services.knowledge_service import KnowledgeService
+
+CATEGORY_SUBJECTS = {
+    'akademik': [
+        'jadwal ujian akhir semester', 'pengisian krs', 'cuti akademik', 'transkrip nilai',
+        'sidang skripsi', 'yudisium', 'ujian remedial', 'perwalian dosen', 'konversi nilai',
+        'kalender akademik', 'pendaftaran wisuda', 'seminar proposal'
+    ],
+    'keuangan': [
+        'pembayaran ukt', 'beasiswa ppa', 'keringanan ukt', 'denda keterlambatan',
+        'pengembalian biaya', 'cicilan ukt', 'biaya wisuda', 'beasiswa kip kuliah'
+    ],
+    'fasilitas': [
+        'peminjaman buku perpustakaan', 'laboratorium komputer', 'jaringan wifi kampus',
+        'parkir kendaraan', 'asrama mahasiswa', 'klinik kesehatan', 'ruang seminar'
+    ],
+    'administrasi': [
+        'surat keterangan aktif kuliah', 'legalisir ijazah', 'kartu tanda mahasiswa',
+        'pindah program studi', 'pengunduran diri', 'surat rekomendasi beasiswa'
+    ],
+    'kemahasiswaan': [
+        'pendaftaran ukm', 'lomba karya tulis', 'magang industri', 'kuliah kerja nyata',
+        'organisasi himpunan'
+    ]
+}
+
+PROGRAMS = [
+    'teknik informatika', 'sistem informasi', 'manajemen', 'akuntansi', 'ilmu hukum',
+    'ilmu keperawatan', 'pendidikan bahasa inggris', 'agroteknologi', 'teknik sipil', 'farmasi',
+    'kebidanan', 'ekonomi pembangunan', 'pendidikan matematika', 'teknik mesin', 'agribisnis',
+    'ilmu komunikasi', 'administrasi publik', 'pendidikan guru sekolah dasar', 'teknik elektro',
+    'kesehatan masyarakat', 'peternakan', 'kehutanan', 'psikologi', 'sastra indonesia',
+    'pendidikan jasmani', 'arsitektur', 'statistika', 'biologi', 'kimia', 'fisika'
+]
+
+PERIODS = [
+    f"semester {term} {year}"
+    for year in range(2020, 2028) for term in ('ganjil', 'genap', 'pendek')
+]
+
+QUESTION_FORMS = [
+    'Kapan {subject} untuk mahasiswa {program} {period}?',
+    'Bagaimana cara {subject} bagi prodi {program} pada {period}?',
+    'Apa syarat {subject} program studi {program} {period}?',
+    'Berapa lama proses {subject} jurusan {program} {period}?',
+    'Siapa yang mengurus {subject} untuk {program} {period}?'
+]
+
+BUILDINGS = ['gedung rektorat', 'gedung a', 'gedung b', 'aula utama', 'biro akademik', 'biro keuangan']
+MONTHS = ['januari', 'februari', 'maret', 'april', 'mei', 'juni', 'juli', 'agustus',
+          'september', 'oktober', 'november', 'desember']
+FILLER_WORDS = ['tolong', 'mau', 'tanya', 'dong', 'kak', 'min', 'ya', 'gimana', 'info']
+
+KEYBOARD_NEIGHBOURS = {
+    'a': 'sq', 'b': 'vn', 'c': 'xv', 'd': 'sf', 'e': 'wr', 'f': 'dg', 'g': 'fh', 'h': 'gj',
+    'i': 'uo', 'j': 'hk', 'k': 'jl', 'l': 'k', 'm': 'n', 'n': 'bm', 'o': 'ip', 'p': 'o',
+    'r': 'et', 's': 'ad', 't': 'ry', 'u': 'yi', 'w': 'qe', 'y': 'tu'
+}
+
+
+def generate_corpus(size: int, rng: random.Random) -> dict:
+    """Synthetic knowledge node with `size` distinct entries
+
+    Entries enumerate subject x program x period first, then the question
+    forms, so small corpora contain clearly distinct questions.
+    """
+    subjects = [(category, subject) for category, names in CATEGORY_SUBJECTS.items() for subject in names]
+    combinations = list(itertools.product(subjects, PROGRAMS, PERIODS))
+    rng.shuffle(combinations)
+
+    knowledge = {}
+    for position in range(size):
+        (category, subject), program, period = combinations[position % len(combinations)]
+        form = QUESTION_FORMS[(position // len(combinations)) % len(QUESTION_FORMS)]
+        question = form.format(subject=subject, program=program, period=period)
+        if position >= len(combinations) * len(QUESTION_FORMS):
+            question = f"{question[:-1]} gelombang {position // (len(combinations) * len(QUESTION_FORMS)) + 1}?"
+        answer = (
+            f"Untuk {subject} mahasiswa {program} {period}, silakan datang ke {rng.choice(BUILDINGS)} "
+            f"paling lambat tanggal {rng.randint(1, 28)} {rng.choice(MONTHS)}. "
+            f"Informasi lengkap tersedia di portal akademik."
+        )
+        knowledge[f"kb{position:06d}"] = {
+            'question': question,
+            'answer': answer,
+            'category': category,
+            'keywords': f"{subject}, {program}",
+            'created_at': '2025-01-01T00:00:00+07:00',
+            'updated_at': '2025-01-01T00:00:00+07:00'
+        }
+    return knowledge
+
+
+def add_typo(word: str, rng: random.Random) -> str:
+    """Apply one keyboard-style typo: deletion, transposition, substitution or doubling"""
+    if len(word) < 5:
+        return word
+    position = rng.randrange(1, len(word) - 1)
+    operation = rng.choice(('delete', 'swap', 'substitute', 'double'))
+    if operation == 'delete':
+        return word[:position] + word[position + 1:]
+    if operation == 'swap':
+        return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    if operation == 'substitute':
+        neighbours = KEYBOARD_NEIGHBOURS.get(word[position])
+        if neighbours:
+            return word[:position] + rng.choice(neighbours) + word[position + 1:]
+        return word
+    return word[:position] + word[position] + word[position:]
+
+
+def generate_queries(knowledge: dict, count: int, typo_rate: float, rng: random.Random) -> list:
+    """(query, labelled knowledge_id) pairs paraphrased from sampled entries
+
+    Queries keep the distinguishing words of their entry, drop some of the
+    rest, add chat filler and misspell words with probability typo_rate.
+    """
+    knowledge_ids = list(knowledge)
+    queries = []
+    for _ in range(count):
+        knowledge_id = rng.choice(knowledge_ids)
+        words = knowledge[knowledge_id]['question'].rstrip('?').lower().split()
+        words = [word for word in words if rng.random() > 0.2 or len(word) > 6]
+        words = [add_typo(word, rng) if rng.random() < typo_rate else word for word in words]
+        if rng.random() < 0.3:
+            words.insert(0, rng.choice(FILLER_WORDS))
+        queries.append((' '.join(words), knowledge_id))
+    return queries
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class BenchmarkKnowledgeService(KnowledgeService):
+    """KnowledgeService bound to a private database"""
+
+    def __init__(self, database, cache_size: int):
+        super().__init__()
+        self.database = database
+        self.search_cache.max_size = cache_size
+
+    def get_db_ref(self):
+        return self.database
+
+
+def build_database(knowledge: dict, backend: str):
+    """Private database holding the corpus"""
+    if backend == 'sqlite':
+        database = SQLiteDatabase(os.path.join(tempfile.mkdtemp(prefix='search-benchmark-'), 'benchmark.sqlite3'))
+        database.child('knowledge').set(knowledge)
+        database.child('knowledge_meta').set({'version': 'benchmark'})
+        return database
+    database = MockDatabase()
+    database.data['knowledge'] = knowledge
+    database.data['knowledge_meta'] = {'version': 'benchmark'}
+    return database
+
+
+def build_service(knowledge: dict, queries: list, mode: str, cache_size: int,
+                  backend: str = 'mock') -> BenchmarkKnowledgeService:
+    """Fresh service over a private database with its index (and vector backend) built"""
+    database = build_database(knowledge, backend)
+    service = BenchmarkKnowledgeService(database, cache_size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        service.warm_up(mode)
+        service.search_knowledge(queries[0][0], mode=mode)
+    service.search_cache.clear()
+    return service
+
+
+def run_case(knowledge: dict, queries: list, mode: str, cache_size: int, measure_memory: bool = True,
+             backend: str = 'mock') -> dict:
+    build_peak = None
+    if measure_memory:
+        # tracemalloc slows allocation down, so memory gets its own build
+        tracemalloc.start()
+        build_service(knowledge, queries, mode, cache_size, backend)
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    build_started = time.perf_counter()
+    service = build_service(knowledge, queries, mode, cache_size, backend)
+    build_seconds = time.perf_counter() - build_started
+    sink = io.StringIO()
+
+    questions = {knowledge_id: f"Q: {knowledge[knowledge_id]['question']}\n" for _, knowledge_id in queries}
+    latencies = []
+    hits = 0
+    started = time.perf_counter()
+    for query, knowledge_id in queries:
+        query_started = time.perf_counter()
+        with contextlib.redirect_stdout(sink):
+            result = service.search_knowledge(query, mode=mode)
+        latencies.append((time.perf_counter() - query_started) * 1000)
+        if questions[knowledge_id] in result['context']:
+            hits += 1
+        sink.seek(0)
+        sink.truncate()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'size': len(knowledge),
+        'mode': mode,
+        'backend': backend,
+        'queries': len(queries),
+        'build_seconds': round(build_seconds, 3),
+        'build_peak_mb': round(build_peak / 1024 / 1024, 1) if build_peak is not None else None,
+        'throughput_qps': round(len(queries) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'recall_at_3': round(hits / len(queries), 4),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'cache': service.get_search_cache_stats() if cache_size else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='100,1000,10000,100000', help='comma-separated corpus sizes')
+    parser.add_argument('--modes', default='bm25', help='comma-separated search modes (bm25, tfidf, hybrid, legacy)')
+    parser.add_argument('--queries', type=int, default=500, help='queries replayed per case')
+    parser.add_argument('--typo-rate', type=float, default=0.15, help='probability of a typo per query word')
+    parser.add_argument('--cache-size', type=int, default=0, help='search cache entries (0 measures uncached ranking)')
+    parser.add_argument('--skip-memory', action='store_true', help='skip the traced build that measures peak memory')
+    parser.add_argument('--backend', choices=('mock', 'sqlite'), default='mock',
+                        help='database the corpus is loaded from (build times include its reads)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+
+    header = f"{'size':>7} {'mode':>7} {'build s':>8} {'peak MB':>8} {'q/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'recall@3':>8}"
+    print(header)
+    print('-' * len(header))
+
+    results = []
+    for size in sizes:
+        rng = random.Random(args.seed + size)
+        knowledge = generate_corpus(size, rng)
+        queries = generate_queries(knowledge, args.queries, args.typo_rate, rng)
+        for mode in modes:
+            result = run_case(knowledge, queries, mode, args.cache_size, not args.skip_memory, args.backend)
+            results.append(result)
+            print(
+                f"{result['size']:>7} {result['mode']:>7} {result['build_seconds']:>8} {str(result['build_peak_mb']):>8} "
+                f"{result['throughput_qps']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                f"{result['recall_at_3']:>8}"
+            )
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()